@@ -0,0 +1,218 @@
+import os
+import json
+import math
+import time
+import asyncio
+import contextlib
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def body(self) -> dict:
+        return {"error": self.reason, "retry_after": math.ceil(self.retry_after)}
+
+    def headers(self) -> dict:
+        return {"Retry-After": str(math.ceil(self.retry_after))}
+
+
+class EndpointLimiter:
+    """
+    Concurrency limit with per-user fair-share queueing.
+    Waiters are grouped by user and served round-robin, so one user's burst
+    cannot hold the queue. Requests are shed immediately when the queue (503)
+    or the user's share of it (429) is full, or after waiting `max_wait` (503).
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, max_queue_per_user: int, max_wait: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.max_wait = max_wait
+        self.active = 0
+        self.queued = 0
+        self.queues = OrderedDict()  # user -> deque of waiter futures
+        self.admitted = 0
+        self.shed = {429: 0, 503: 0}
+        self.avg_service_s = 1.0
+
+    def retry_after(self) -> float:
+        """Rough time until a slot frees up for a new arrival."""
+        backlog = self.queued + 1
+        return max(1.0, backlog * self.avg_service_s / self.max_concurrency)
+
+    def _reject(self, status_code: int, reason: str):
+        self.shed[status_code] += 1
+        raise Overloaded(status_code, f"{self.name}: {reason}", self.retry_after())
+
+    async def acquire(self, user: str):
+        if self.active < self.max_concurrency and self.queued == 0:
+            self.active += 1
+            self.admitted += 1
+            return
+
+        if self.queued >= self.max_queue:
+            self._reject(503, "server busy")
+        queue = self.queues.get(user)
+        if queue is not None and len(queue) >= self.max_queue_per_user:
+            self._reject(429, "too many requests in flight for this user")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(user, deque()).append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, timeout=self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over just as we gave up: pass it on
+                self.release(0.0)
+            else:
+                self._forget(user, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(503, "queue wait timed out")
+            raise
+        self.admitted += 1
+
+    def _forget(self, user: str, waiter):
+        queue = self.queues.get(user)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.queued -= 1
+            if not queue:
+                del self.queues[user]
+
+    def release(self, service_s: float):
+        if service_s:
+            self.avg_service_s = 0.8 * self.avg_service_s + 0.2 * service_s
+        # Hand the slot to the next user in round-robin order
+        while self.queues:
+            user, queue = self.queues.popitem(last=False)
+            waiter = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self.queues[user] = queue
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "queued_users": len(self.queues),
+            "admitted": self.admitted,
+            "shed_429": self.shed[429],
+            "shed_503": self.shed[503],
+            "avg_service_s": round(self.avg_service_s, 3),
+        }
+
+
+def _limiter(name: str, env_prefix: str, concurrency: int, queue: int, per_user: int, max_wait: float):
+    return EndpointLimiter(
+        name,
+        max_concurrency=int(os.getenv(f"{env_prefix}_MAX_CONCURRENCY", concurrency)),
+        max_queue=int(os.getenv(f"{env_prefix}_MAX_QUEUE", queue)),
+        max_queue_per_user=int(os.getenv(f"{env_prefix}_MAX_QUEUE_PER_USER", per_user)),
+        max_wait=float(os.getenv(f"{env_prefix}_MAX_WAIT_S", max_wait)),
+    )
+
+
+# Long model calls get tight limits; cheap reads have their own lane so they are never
+# queued behind scans or chat turns.
+limiters = {
+    "/scan": _limiter("scan", "SCAN", 4, 16, 2, 30),
+    "/chat": _limiter("chat", "CHAT", 16, 64, 4, 20),
+    "/agent-act": _limiter("agent-act", "AGENT", 4, 16, 2, 20),
+}
+read_limiter = _limiter("reads", "READ", 64, 256, 16, 5)
+READ_PATHS = {"/health-data", "/health-history", "/cohort-summary", "/auth/status"}
+
+# These endpoints carry user_id in the JSON body, which the middleware can't see (it
+# would fall back to the client address, i.e. the proxy's on Render, and turn the
+# per-user cap into a global one). They call `admit` themselves once the body is parsed.
+ENDPOINT_ADMITTED = {"/chat", "/agent-act"}
+
+
+@contextlib.asynccontextmanager
+async def admit(path: str, user: str):
+    """Holds a slot of `limiters[path]` for `user`; raises Overloaded when shed."""
+    limiter = limiters[path]
+    await limiter.acquire(user)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        limiter.release(time.monotonic() - started)
+
+
+def _user_key(scope) -> str:
+    query = parse_qs(scope.get("query_string", b"").decode())
+    if query.get("user_id"):
+        return query["user_id"][0]
+    for name, value in scope.get("headers", []):
+        if name == b"x-user-id":
+            return value.decode()
+    client = scope.get("client")
+    return client[0] if client else "anonymous"
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying `limiters` by path to endpoints whose user is in the query
+    string (or X-User-ID); ENDPOINT_ADMITTED paths and everything else pass through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        if path in ENDPOINT_ADMITTED:
+            return await self.app(scope, receive, send)
+        limiter = limiters.get(path) or (read_limiter if path in READ_PATHS else None)
+        if limiter is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            await limiter.acquire(_user_key(scope))
+        except Overloaded as e:
+            return await self._shed(send, e)
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - started)
+
+    async def _shed(self, send, error: Overloaded):
+        body = json.dumps(error.body()).encode()
+        await send({
+            "type": "http.response.start",
+            "status": error.status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                *((name.lower().encode(), value.encode()) for name, value in error.headers().items()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def stats() -> dict:
+    return {
+        **{path: limiter.stats() for path, limiter in limiters.items()},
+        "reads": read_limiter.stats(),
+    }
@@ -0,0 +1,61 @@
+"""
+Per-request agent setup overhead for /agent-act, before and after the warm pool.
+
+Run from backend/:  python -m benchmarks.agent_setup [iterations]
+
+"before" replays the old path: a GoogleCalendarService (Firestore client + token
+read) plus a GenerativeModel with tool schema introspection on every request.
+"after" is a checkout/release from twin_agent.agent_pool.
+"""
+import sys
+import time
+import statistics
+
+import google.generativeai as genai
+
+import firebase_config
+import google_calendar
+import twin_agent
+
+
+def legacy_setup(user_id: str):
+    agent = twin_agent.GeminiAgent.__new__(twin_agent.GeminiAgent)
+    if firebase_config.db:
+        google_calendar.GoogleCalendarService(user_id=user_id)
+    tools = [agent.book_appointment, agent.block_calendar_for_nap, agent.order_supplements]
+    model = genai.GenerativeModel(
+        model_name="models/gemini-3-flash-preview",
+        tools=tools,
+        system_instruction=twin_agent.SYSTEM_INSTRUCTION
+    )
+    return model.start_chat(enable_automatic_function_calling=True)
+
+
+def pooled_setup(user_id: str):
+    with twin_agent.agent_pool.checkout(user_id) as agent:
+        return agent.chat
+
+
+def measure(fn, iterations: int):
+    timings = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn(f"bench_user_{i % 10}")
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(label: str, timings: list):
+    ordered = sorted(timings)
+    p95 = ordered[int(0.95 * (len(ordered) - 1))]
+    print(f"{label:<8} mean={statistics.mean(timings):8.3f} ms  p50={statistics.median(timings):8.3f} ms  p95={p95:8.3f} ms")
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    if not firebase_config.db:
+        print("Firestore not configured: 'before' excludes the calendar token read.")
+
+    report("before", measure(legacy_setup, iterations))
+    report("after", measure(pooled_setup, iterations))
+    print(twin_agent.agent_pool.stats())
@@ -0,0 +1,65 @@
+"""
+Per-request cost of hot-path logging as seen by the request handler.
+
+Run from backend/:  python -m benchmarks.logging_overhead [requests] > /dev/null
+
+Each simulated request emits the same four events (two debug, two info). Compares
+synchronous print(), a stdlib logger writing straight to stdout, and the queued
+JSON logger from log_config, where formatting and I/O happen on the listener thread.
+Timings go to stderr so stdout can be discarded.
+
+print() to /dev/null is the floor, not the baseline: against a real log pipe its
+write blocks the request, which is what the queued logger moves off the hot path.
+A burst larger than LOG_QUEUE_SIZE shows up as dropped records rather than latency.
+"""
+import sys
+import time
+import logging
+
+import log_config
+
+EVENTS_PER_REQUEST = 4
+
+
+def with_print(i: int):
+    print(f"DEBUG: Chat request from user_id=user_{i}")
+    print("DEBUG: Using existing agent session")
+    print("[INTENT] simple answered locally")
+    print(f"DEBUG: Agent response: {'x' * 50}...")
+
+
+def with_logger(logger: logging.Logger, i: int):
+    logger.debug("chat request", extra={"user_id": f"user_{i}"})
+    logger.debug("intent answered locally", extra={"intent": "simple"})
+    logger.info("chat reply sent", extra={"user_id": f"user_{i}", "reply_chars": 50})
+    logger.info("request finished", extra={"status": 200})
+
+
+def time_per_request(fn, requests: int) -> float:
+    started = time.perf_counter()
+    for i in range(requests):
+        log_config.request_id_var.set(f"req-{i}")
+        fn(i)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    results = {"print()": time_per_request(with_print, requests)}
+
+    direct = logging.getLogger("bench.direct")
+    direct.propagate = False
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(log_config.JSONFormatter())
+    direct.addHandler(handler)
+    direct.setLevel(logging.DEBUG)
+    results["logger -> stdout (sync)"] = time_per_request(lambda i: with_logger(direct, i), requests)
+
+    log_config.setup_logging()
+    queued = log_config.get_logger("bench")
+    results["queued JSON logger"] = time_per_request(lambda i: with_logger(queued, i), requests)
+
+    for label, micros in results.items():
+        print(f"{label:<26} {micros:9.2f} us/request", file=sys.stderr)
+    print(f"dropped by full queue: {log_config.stats()['dropped']}", file=sys.stderr)
@@ -0,0 +1,70 @@
+"""
+Encode time and bytes on the wire for a /health-data payload.
+
+Run from backend/:  python -m benchmarks.response_encoding [iterations]
+
+Compares FastAPI's default path (jsonable_encoder + stdlib json), the orjson
+response class, and a pre-serialized cache hit, then the body size raw, gzipped
+and (if installed) brotli-compressed.
+"""
+import sys
+import gzip
+import json
+import time
+import datetime
+
+from fastapi.encoders import jsonable_encoder
+
+import fast_json
+
+
+def sample_health_doc(correlations: int = 40) -> dict:
+    return {
+        "status": "Critical",
+        "hydration": "Low",
+        "lastScan": "Just Now",
+        "details": "Vitamin D deficiency with elevated cortisol and borderline HbA1c. " * 4,
+        "score": 62,
+        "velocity": "Declining",
+        "riskFactor": "High Cortisol",
+        "correlations": [
+            {
+                "title": f"Insight {i}",
+                "description": "Low Vitamin D levels correlate with the reported fatigue and poor sleep quality.",
+                "type": "negative" if i % 2 else "neutral",
+            }
+            for i in range(correlations)
+        ],
+        "user_id": "bench_user",
+        "timestamp": datetime.datetime.now(datetime.timezone.utc),
+    }
+
+
+def time_per_call(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    doc = sample_health_doc()
+    cache = fast_json.PayloadCache()
+    cache.get_or_build("bench_user", lambda: doc)
+
+    results = {
+        "jsonable_encoder + json": time_per_call(lambda: json.dumps(jsonable_encoder(doc)).encode(), iterations),
+        "orjson (FastJSONResponse)": time_per_call(lambda: fast_json.dumps(doc), iterations),
+        "pre-serialized cache hit": time_per_call(lambda: cache.get_or_build("bench_user", lambda: doc), iterations),
+    }
+    for label, micros in results.items():
+        print(f"{label:<28} {micros:9.2f} us/response")
+
+    body = fast_json.dumps(doc)
+    print(f"\n{'raw':<28} {len(body):6d} bytes")
+    print(f"{'gzip (level 6)':<28} {len(gzip.compress(body, compresslevel=6)):6d} bytes")
+    if fast_json.brotli is not None:
+        print(f"{'brotli (quality 4)':<28} {len(fast_json.brotli.compress(body, quality=4)):6d} bytes")
+    else:
+        print("brotli not installed: responses fall back to gzip")
@@ -0,0 +1,250 @@
+"""
+Population baselines across every user's healthScans.
+
+    python cohort_analytics.py [--workers 4] [--page-size 500] [--output cohort_summary.json]
+
+Streams all `users/*/healthScans` documents (collection group query, cursor paged,
+projected to the aggregated fields), aggregates each page in a process pool into a
+mergeable CohortSketch, merges the sketches and writes a compact summary to
+Firestore (`analytics/cohortSummary`) and a local JSON file served by /cohort-summary.
+
+To run against the Firestore emulator instead of production, set
+FIRESTORE_EMULATOR_HOST (e.g. localhost:8080) and optionally FIREBASE_PROJECT_ID;
+firebase_config then connects without credentials. `run()` also accepts any client
+with the same query API (see tests/test_cohort_analytics.py).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import log_config
+
+logger = log_config.get_logger("cohort_analytics")
+
+FIELDS = ["score", "riskFactor", "hydration"]
+# Same path as firestore.FieldPath.document_id(), without importing firebase_admin
+DOCUMENT_ID = "__name__"
+SUMMARY_PATH = os.getenv("COHORT_SUMMARY_PATH", "cohort_summary.json")
+PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+# A local summary file older than this is treated as stale and Firestore is tried instead
+SUMMARY_MAX_AGE_S = float(os.getenv("COHORT_SUMMARY_MAX_AGE_S", str(26 * 3600)))
+# How long a summary read from Firestore is served before it is read again
+SUMMARY_TTL_S = float(os.getenv("COHORT_SUMMARY_TTL_S", "300"))
+
+
+class CohortSketch:
+    """
+    Mergeable aggregate of scan records.
+    Scores are integers in 0-100, so a 101-bin histogram gives exact percentiles
+    and merges by addition; categorical fields are counters.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.score_bins = [0] * 101
+        self.unscored = 0
+        self.risk_factors = Counter()
+        self.hydration = Counter()
+
+    def add(self, record: dict):
+        self.count += 1
+        score = _as_score(record.get("score"))
+        if score is None:
+            self.unscored += 1
+        else:
+            self.score_bins[score] += 1
+        self.risk_factors[_normalize_label(record.get("riskFactor"))] += 1
+        self.hydration[_normalize_label(record.get("hydration"))] += 1
+
+    def merge(self, other: "CohortSketch") -> "CohortSketch":
+        self.count += other.count
+        self.score_bins = [a + b for a, b in zip(self.score_bins, other.score_bins)]
+        self.unscored += other.unscored
+        self.risk_factors.update(other.risk_factors)
+        self.hydration.update(other.hydration)
+        return self
+
+    def score_percentile(self, p: float):
+        scored = self.count - self.unscored
+        if not scored:
+            return None
+        rank = p / 100 * (scored - 1)
+        seen = 0
+        for score, n in enumerate(self.score_bins):
+            seen += n
+            if seen > rank:
+                return score
+        return 100
+
+    def summary(self, top_n: int = 20) -> dict:
+        scored = self.count - self.unscored
+        mean = sum(score * n for score, n in enumerate(self.score_bins)) / scored if scored else None
+        return {
+            "scans": self.count,
+            "score": {
+                "count": scored,
+                "unscored": self.unscored,
+                "mean": round(mean, 2) if mean is not None else None,
+                "percentiles": {f"p{p}": self.score_percentile(p) for p in PERCENTILES},
+                # 10-point buckets are enough to draw a distribution
+                "histogram": [sum(self.score_bins[i:i + 10]) for i in range(0, 90, 10)]
+                             + [sum(self.score_bins[90:])],
+            },
+            "riskFactor": _distribution(self.risk_factors, self.count, top_n),
+            "hydration": _distribution(self.hydration, self.count, top_n),
+        }
+
+
+def _as_score(value):
+    try:
+        score = int(round(float(value)))
+    except (TypeError, ValueError):
+        return None  # "--" placeholder from failed scans
+    return min(100, max(0, score))
+
+
+def _normalize_label(value) -> str:
+    return str(value).strip().title() if value not in (None, "") else "Unknown"
+
+
+def _distribution(counter: Counter, total: int, top_n: int) -> dict:
+    top = counter.most_common(top_n)
+    other = total - sum(n for _, n in top)
+    shares = {label: round(n / total, 4) for label, n in top} if total else {}
+    if other > 0:
+        shares["Other"] = round(other / total, 4)
+    return shares
+
+
+def summarize_page(records: list) -> CohortSketch:
+    """Process-pool worker: aggregate one page of plain-dict records."""
+    sketch = CohortSketch()
+    for record in records:
+        sketch.add(record)
+    return sketch
+
+
+def iter_pages(db, page_size: int = 500):
+    """Yields (records, user_ids) per page of the healthScans collection group."""
+    base = db.collection_group('healthScans').select(FIELDS).order_by(DOCUMENT_ID)
+    last = None
+    while True:
+        query = base.start_after(last) if last is not None else base
+        docs = list(query.limit(page_size).stream())
+        if not docs:
+            return
+        records = [doc.to_dict() for doc in docs]
+        user_ids = {doc.reference.parent.parent.id for doc in docs}
+        yield records, user_ids
+        if len(docs) < page_size:
+            return
+        last = docs[-1]
+
+
+def run(db, workers: int = None, page_size: int = 500) -> dict:
+    """Aggregates every scan and returns the summary dict."""
+    started = time.monotonic()
+    total = CohortSketch()
+    users = set()
+    workers = workers or os.cpu_count() or 2
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for records, user_ids in iter_pages(db, page_size):
+            users.update(user_ids)
+            # Bound the number of pages held in memory
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    total.merge(future.result())
+            in_flight.add(pool.submit(summarize_page, records))
+        for future in in_flight:
+            total.merge(future.result())
+
+    summary = total.summary()
+    summary["users"] = len(users)
+    summary["generated_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    summary["duration_s"] = round(time.monotonic() - started, 2)
+    return summary
+
+
+def write_summary(summary: dict, db=None, path: str = SUMMARY_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    if db is not None:
+        db.collection('analytics').document('cohortSummary').set(summary)
+
+
+class SummaryCache:
+    """
+    Serves the precomputed summary as ready-to-send bytes. The local file is used
+    while it is fresher than `max_age_s` and reloaded when its mtime changes;
+    when it is missing or stale, `analytics/cohortSummary` is read from `db`
+    and cached for `ttl_s`. A stale file is still served if Firestore has nothing.
+    """
+
+    def __init__(self, path: str = SUMMARY_PATH, db=None, max_age_s: float = SUMMARY_MAX_AGE_S,
+                 ttl_s: float = SUMMARY_TTL_S):
+        self.path = path
+        self.db = db
+        self.max_age_s = max_age_s
+        self.ttl_s = ttl_s
+        self.mtime = None
+        self.body = None
+        self.remote_body = None
+        self.remote_expires = 0.0
+
+    def get(self):
+        body, fresh = self._from_file()
+        if fresh or self.db is None:
+            return body
+        return self._from_firestore() or body
+
+    def _from_file(self):
+        """(body, fresh) for the local file; (None, False) when it doesn't exist."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None, False
+        if mtime != self.mtime:
+            with open(self.path, "rb") as f:
+                self.body = f.read()
+            self.mtime = mtime
+        return self.body, time.time() - mtime <= self.max_age_s
+
+    def _from_firestore(self):
+        now = time.monotonic()
+        if now < self.remote_expires:
+            return self.remote_body
+        try:
+            snapshot = self.db.collection('analytics').document('cohortSummary').get()
+        except Exception as e:
+            logger.warning("cohort summary read from Firestore failed", extra={"error": str(e)})
+            return self.remote_body
+        if snapshot.exists:
+            self.remote_body = json.dumps(snapshot.to_dict(), separators=(",", ":"), default=str).encode()
+        self.remote_expires = now + self.ttl_s
+        return self.remote_body
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute cohort baselines over all healthScans")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--output", default=SUMMARY_PATH)
+    args = parser.parse_args()
+
+    import firebase_config
+    if not firebase_config.db:
+        sys.exit("Firestore is not configured (FIREBASE_CREDENTIALS / serviceAccountKey.json / FIRESTORE_EMULATOR_HOST).")
+
+    result = run(firebase_config.db, workers=args.workers, page_size=args.page_size)
+    write_summary(result, db=firebase_config.db, path=args.output)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,162 @@
+import gzip
+import time
+import datetime
+import threading
+import orjson
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent as-is; compression would cost more than it saves
+MIN_COMPRESS_SIZE = 1024
+
+
+def _default(obj):
+    # Firestore timestamps are datetime subclasses, which orjson only serializes natively as exact types
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if hasattr(obj, "dict"):
+        return obj.dict()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content, sort_keys: bool = False) -> bytes:
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return orjson.dumps(content, default=_default, option=option)
+
+
+class FastJSONResponse(JSONResponse):
+    """App-wide default response class: orjson encoding with Firestore-aware fallbacks."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def json_bytes_response(body: bytes, headers: dict = None) -> Response:
+    """Sends already-serialized JSON, skipping FastAPI's jsonable_encoder pass entirely."""
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+class PayloadCache:
+    """
+    Pre-serialized JSON payloads for cacheable reads, keyed by e.g. user id.
+    Entries are dropped explicitly when the underlying data changes and expire
+    after `ttl_s` to pick up writes made outside this process (e.g. by the frontend).
+    A build that overlaps an `invalidate` of its key is returned but not stored, so
+    data read before a write cannot be cached after it.
+    """
+
+    def __init__(self, ttl_s: float = 30.0, max_entries: int = 10000):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.entries = {}
+        # Per-key invalidation counters, plus an epoch for the bulk clear on overflow
+        self.generations = {}
+        self.epoch = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build) -> bytes:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            started_at = (self.epoch, self.generations.get(key, 0))
+
+        body = dumps(build())
+        with self.lock:
+            if (self.epoch, self.generations.get(key, 0)) != started_at:
+                return body  # invalidated while building: the result may predate the write
+            if len(self.entries) >= self.max_entries:
+                self.entries.clear()
+                self.generations.clear()
+                self.epoch += 1
+            self.entries[key] = (now + self.ttl_s, body)
+        return body
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.generations[key] = self.generations.get(key, 0) + 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def _accepted_encoding(headers) -> str:
+    accept = ""
+    for name, value in headers:
+        if name == b"accept-encoding":
+            accept = value.decode().lower()
+            break
+    tokens = {part.split(";")[0].strip() for part in accept.split(",")}
+    if brotli is not None and "br" in tokens:
+        return "br"
+    if "gzip" in tokens:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Negotiated brotli/gzip for JSON bodies of at least MIN_COMPRESS_SIZE bytes.
+    Only JSON responses are buffered and compressed; anything else (e.g. event
+    streams) passes through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = MIN_COMPRESS_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = _accepted_encoding(scope.get("headers", []))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        chunks = []
+        passthrough = False
+
+        async def wrapped_send(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", []))
+                is_json = headers.get(b"content-type", b"").startswith(b"application/json")
+                if not is_json or b"content-encoding" in headers:
+                    passthrough = True
+                    return await send(message)
+                start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                return await send(message)
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            await self._send_compressed(send, start, b"".join(chunks), encoding)
+
+        await self.app(scope, receive, wrapped_send)
+
+    async def _send_compressed(self, send, start, body: bytes, encoding: str):
+        headers = [(k, v) for k, v in start.get("headers", []) if k != b"content-length"]
+        if len(body) >= self.minimum_size:
+            body = brotli.compress(body, quality=4) if encoding == "br" else gzip.compress(body, compresslevel=6)
+            headers.append((b"content-encoding", encoding.encode()))
+        headers.append((b"vary", b"Accept-Encoding"))
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({**start, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -2,6 +2,15 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 import os
 
+
+class _EmulatorCredential(credentials.Base):
+    """No-op credential for the Firestore emulator, which accepts unauthenticated clients"""
+
+    def get_credential(self):
+        from google.auth.credentials import AnonymousCredentials
+        return AnonymousCredentials()
+
+
 # Initialize Firebase Admin SDK
 def initialize_firebase():
     """Initialize Firebase Admin SDK with service account credentials"""
@@ -10,6 +19,13 @@ def initialize_firebase():
         firebase_admin.get_app()
         print("Firebase already initialized")
     except ValueError:
+        # Local Firestore emulator (tests, batch jobs): no credentials, just a project id
+        if os.getenv('FIRESTORE_EMULATOR_HOST'):
+            project_id = os.getenv('FIREBASE_PROJECT_ID', 'demo-biotwin')
+            firebase_admin.initialize_app(_EmulatorCredential(), {'projectId': project_id})
+            print(f"Firebase Admin SDK using Firestore emulator at {os.getenv('FIRESTORE_EMULATOR_HOST')} (project {project_id})")
+            return firestore.client()
+
         # Check for environment variable (for Render/Production)
         firebase_creds = os.getenv('FIREBASE_CREDENTIALS')
         
@@ -0,0 +1,193 @@
+import os
+import time
+import bisect
+import datetime
+import threading
+
+import singleflight
+
+# How long a fetched window is trusted before picking up edits made outside the app
+FREEBUSY_TTL_S = float(os.getenv("FREEBUSY_TTL_S", "300"))
+# Span fetched by one freeBusy query, starting at midnight UTC of the requested day
+FREEBUSY_WINDOW_DAYS = int(os.getenv("FREEBUSY_WINDOW_DAYS", "7"))
+
+
+def _utc(value: datetime.datetime) -> datetime.datetime:
+    return value.astimezone(datetime.timezone.utc)
+
+
+def _parse(value: str) -> datetime.datetime:
+    return _utc(datetime.datetime.fromisoformat(value.replace("Z", "+00:00")))
+
+
+def _align_up(value: datetime.datetime, step: datetime.timedelta, tz) -> datetime.datetime:
+    """Rounds `value` up to the next `step` boundary of the wall clock in `tz` (`step` must divide an hour)."""
+    local = value.astimezone(tz)
+    past_hour = datetime.timedelta(minutes=local.minute, seconds=local.second, microseconds=local.microsecond)
+    remainder = past_hour % step
+    return value if not remainder else value + (step - remainder)
+
+
+def _within_day(value: datetime.datetime, duration: datetime.timedelta, day_window: tuple, tz) -> datetime.datetime:
+    """`value` if [value, value + duration) fits in the local `day_window`, else that window's next opening."""
+    local = value.astimezone(tz)
+    opens, closes = day_window
+    day_start = datetime.datetime.combine(local.date(), opens, tzinfo=tz)
+    if local < day_start:
+        return _utc(day_start)
+    if local + duration > datetime.datetime.combine(local.date(), closes, tzinfo=tz):
+        return _utc(datetime.datetime.combine(local.date() + datetime.timedelta(days=1), opens, tzinfo=tz))
+    return value
+
+
+class FreeBusyIndex:
+    """
+    Busy intervals of one calendar over [window_start, window_end), kept merged and
+    sorted in two parallel lists so point and range checks are a bisect away.
+    All datetimes are timezone-aware and stored in UTC.
+    """
+
+    def __init__(self, window_start, window_end, busy=()):
+        self.window_start = _utc(window_start)
+        self.window_end = _utc(window_end)
+        self.starts = []
+        self.ends = []
+        self.lock = threading.Lock()
+        for start, end in sorted((_utc(s), _utc(e)) for s, e in busy):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def covers(self, start, end) -> bool:
+        return self.window_start <= _utc(start) and _utc(end) <= self.window_end
+
+    def add(self, start, end):
+        """Marks [start, end) busy, merging with any intervals it touches."""
+        start, end = _utc(start), _utc(end)
+        with self.lock:
+            lo = bisect.bisect_left(self.ends, start)
+            hi = bisect.bisect_right(self.starts, end)
+            if lo < hi:
+                start = min(start, self.starts[lo])
+                end = max(end, self.ends[hi - 1])
+            self.starts[lo:hi] = [start]
+            self.ends[lo:hi] = [end]
+
+    def is_free(self, start, end) -> bool:
+        start, end = _utc(start), _utc(end)
+        with self.lock:
+            # The only interval that can overlap is the last one starting before `end`
+            i = bisect.bisect_left(self.starts, end) - 1
+            return i < 0 or self.ends[i] <= start
+
+    def next_free(self, earliest, duration: datetime.timedelta, step: datetime.timedelta = None,
+                  max_shift: datetime.timedelta = None, day_window: tuple = None):
+        """
+        Earliest start >= `earliest` where `duration` fits without touching a busy
+        interval, or None if nothing fits. With `step`, starts are rounded up to clock
+        boundaries (e.g. :00/:15/:30/:45) in `earliest`'s time zone. `max_shift` caps
+        how far past `earliest` the start may move, and `day_window` (start, end)
+        `datetime.time`s keeps the whole slot inside those local hours.
+        """
+        tz = earliest.tzinfo
+        candidate = _utc(earliest)
+        latest = candidate + max_shift if max_shift is not None else None
+        with self.lock:
+            # First interval that ends after the candidate
+            i = bisect.bisect_right(self.ends, candidate)
+            while True:
+                if step:
+                    candidate = _align_up(candidate, step, tz)
+                if day_window:
+                    candidate = _within_day(candidate, duration, day_window, tz)
+                if candidate + duration > self.window_end or (latest is not None and candidate > latest):
+                    return None
+                while i < len(self.starts) and self.ends[i] <= candidate:
+                    i += 1
+                if i == len(self.starts) or candidate + duration <= self.starts[i]:
+                    return candidate
+                candidate = self.ends[i]
+                i += 1
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class FreeBusyCache:
+    """
+    Per-user FreeBusyIndex, filled by one freeBusy query per window and kept for
+    FREEBUSY_TTL_S. Events we insert ourselves are added to the cached index
+    instead of forcing a refetch; concurrent misses for a user share one query.
+    """
+
+    def __init__(self, ttl_s: float = FREEBUSY_TTL_S, window_days: int = FREEBUSY_WINDOW_DAYS):
+        self.ttl_s = ttl_s
+        self.window = datetime.timedelta(days=window_days)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.flight = singleflight.SingleFlight("freebusy")
+        self.user_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    def get(self, user_id: str, service, start, end) -> FreeBusyIndex:
+        """Index covering [start, end) for `user_id`, querying `service` on a miss."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and entry[0] > now and entry[1].covers(start, end):
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        window_start = _utc(start).replace(hour=0, minute=0, second=0, microsecond=0)
+        window_end = max(window_start + self.window, _utc(end))
+        return self.flight.do((user_id, window_start, window_end), self._fetch, user_id, service, window_start, window_end)
+
+    def _fetch(self, user_id, service, window_start, window_end) -> FreeBusyIndex:
+        response = service.freebusy().query(body={
+            "timeMin": window_start.isoformat(),
+            "timeMax": window_end.isoformat(),
+            "items": [{"id": "primary"}],
+        }).execute()
+        busy = response.get("calendars", {}).get("primary", {}).get("busy", [])
+        index = FreeBusyIndex(window_start, window_end, [(_parse(b["start"]), _parse(b["end"])) for b in busy])
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl_s, index)
+        return index
+
+    def record_busy(self, user_id: str, start, end):
+        """Reflects an event we just created in the user's cached index, if any."""
+        with self.lock:
+            entry = self.entries.get(user_id)
+            self.recorded += 1
+        if entry:
+            entry[1].add(start, end)
+
+    def user_lock(self, user_id: str) -> threading.Lock:
+        """
+        Serializes check-then-book for one user: hold it from the free-slot lookup
+        through the insert and `record_busy`, so parallel tool calls can't both take a slot.
+        """
+        with self.lock:
+            lock = self.user_locks.get(user_id)
+            if lock is None:
+                lock = self.user_locks[user_id] = threading.Lock()
+            return lock
+
+    def invalidate(self, user_id: str):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "users": len(self.entries),
+                "busy_intervals": sum(len(index) for _, index in self.entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "recorded_inserts": self.recorded,
+            }
@@ -11,9 +11,98 @@ from googleapiclient.errors import HttpError
 import firebase_admin
 from firebase_admin import firestore
 
+import singleflight
+import free_busy
+import token_refresher as token_refresher_module
+import log_config
+
+logger = log_config.get_logger("calendar")
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+# token.json is a single-user dev convenience; in production it is shared by every
+# user of the process, so it is neither read nor written there.
+IS_PRODUCTION = bool(os.getenv('RENDER') or os.getenv('FRONTEND_URL'))
+
+_token_refresh_flight = singleflight.SingleFlight("token-refresh")
+
+
+def _persist_credentials(user_id, creds):
+    """Save credentials to Firestore (production) and, in development, the local token.json"""
+    token_info = json.loads(creds.to_json())
+
+    # Save to Firestore (primary - works on Render)
+    try:
+        firestore.client().collection('oauth_tokens').document(user_id).set({
+            'token': token_info,
+            'updated_at': datetime.datetime.now(),
+            'user_id': user_id
+        })
+        logger.debug("saved credentials to Firestore", extra={"user_id": user_id})
+    except Exception as e:
+        logger.error("error saving credentials to Firestore", extra={"user_id": user_id, "error": str(e)})
+
+    # Also save locally for development convenience
+    if not IS_PRODUCTION:
+        try:
+            with open('token.json', 'w') as token:
+                token.write(creds.to_json())
+        except Exception as e:
+            logger.warning("could not save local token file", extra={"error": str(e)})
+
+
+def _refresh_and_persist(user_id, creds):
+    creds.refresh(Request())
+    # Save refreshed token. Not tracked here: this is also the background refresher's
+    # refresh_fn, and tracking would count its own refreshes as user activity.
+    _persist_credentials(user_id, creds)
+    return creds
+
+
+def refresh_user_credentials(user_id, creds):
+    """Refreshes a user's token; concurrent callers for the same user share one refresh."""
+    return _token_refresh_flight.do(user_id, _refresh_and_persist, user_id, creds)
+
+
+def _discard_credentials(user_id, error):
+    """Drops a user's stored token after the grant was revoked or expired; they must reconnect."""
+    logger.warning("refresh token rejected, discarding stored credentials", extra={"user_id": user_id, "error": str(error)})
+    try:
+        firestore.client().collection('oauth_tokens').document(user_id).delete()
+    except Exception as e:
+        logger.error("error deleting credentials from Firestore", extra={"user_id": user_id, "error": str(e)})
+
+
+# Refreshes tracked users' tokens shortly before expiry so request paths find them valid.
+# Started/stopped by the app lifecycle in main.py.
+token_refresher = token_refresher_module.TokenRefresher(refresh_user_credentials, on_revoked=_discard_credentials)
+
+# Per-user busy intervals so slots can be chosen without an API call per booking
+free_busy_cache = free_busy.FreeBusyCache()
+
+# Slot grid used when looking for a free slot near a conflict
+SLOT_STEP = datetime.timedelta(minutes=15)
+# How far a suggested or moved slot may be from the requested time
+MAX_SLOT_SHIFT = datetime.timedelta(hours=float(os.getenv('CALENDAR_MAX_SHIFT_H', '3')))
+# Local hours a suggested or moved slot must fall within
+DAY_WINDOW = (
+    datetime.time.fromisoformat(os.getenv('CALENDAR_DAY_START', '08:00')),
+    datetime.time.fromisoformat(os.getenv('CALENDAR_DAY_END', '21:00')),
+)
+
+
+def _zone(name):
+    try:
+        from zoneinfo import ZoneInfo
+    except ImportError:
+        from backports.zoneinfo import ZoneInfo
+    try:
+        return ZoneInfo(name or 'UTC')
+    except Exception:
+        logger.warning("unknown timezone, using UTC", extra={"timezone": name})
+        return ZoneInfo('UTC')
+
 class GoogleCalendarService:
     def __init__(self, user_id: str = "guest_user"):
         self.user_id = user_id
@@ -27,7 +116,13 @@ class GoogleCalendarService:
         self._load_credentials()
     
     def _load_credentials(self):
-        """Load credentials from Firestore (production) or local file (development)"""
+        """Load credentials from the refresher cache, Firestore (production) or local file (development)"""
+        # Already tracked and kept fresh in the background
+        cached = token_refresher.get(self.user_id)
+        if cached:
+            self.creds = cached
+            return
+
         # Try Firestore first (works on Render)
         try:
             token_doc = self.db.collection('oauth_tokens').document(self.user_id).get()
@@ -35,51 +130,40 @@ class GoogleCalendarService:
                 token_data = token_doc.to_dict()
                 if token_data and 'token' in token_data:
                     self.creds = Credentials.from_authorized_user_info(token_data['token'], SCOPES)
-                    print(f"[CALENDAR] Loaded credentials from Firestore for user: {self.user_id}")
+                    logger.debug("loaded credentials from Firestore", extra={"user_id": self.user_id})
+                    token_refresher.track(self.user_id, self.creds)
                     return
         except Exception as e:
-            print(f"[CALENDAR] Could not load from Firestore: {e}")
+            logger.warning("could not load credentials from Firestore", extra={"user_id": self.user_id, "error": str(e)})
         
         # Fallback to local file for development
-        if os.path.exists('token.json'):
+        if not IS_PRODUCTION and os.path.exists('token.json'):
             self.creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-            print(f"[CALENDAR] Loaded credentials from local token.json")
+            logger.debug("loaded credentials from local token.json")
     
     def _save_credentials(self):
-        """Save credentials to both Firestore (for production) and local file (for dev)"""
+        """Save credentials to Firestore (and token.json in development) and track them for background refresh"""
         if not self.creds:
             return
-            
-        token_info = json.loads(self.creds.to_json())
-        
-        # Save to Firestore (primary - works on Render)
-        try:
-            self.db.collection('oauth_tokens').document(self.user_id).set({
-                'token': token_info,
-                'updated_at': datetime.datetime.now(),
-                'user_id': self.user_id
-            })
-            print(f"[CALENDAR] Saved credentials to Firestore for user: {self.user_id}")
-        except Exception as e:
-            print(f"[CALENDAR] Error saving to Firestore: {e}")
-        
-        # Also save locally for development convenience
-        try:
-            with open('token.json', 'w') as token:
-                token.write(self.creds.to_json())
-        except Exception as e:
-            print(f"[CALENDAR] Could not save local token file: {e}")
+
+        _persist_credentials(self.user_id, self.creds)
+        token_refresher.track(self.user_id, self.creds)
 
     def is_authorized(self):
         if not self.creds or not self.creds.valid:
             if self.creds and self.creds.expired and self.creds.refresh_token:
                 try:
-                    self.creds.refresh(Request())
-                    # Save refreshed token
-                    self._save_credentials()
+                    # One refresh (and one Firestore write) per user, however many callers race here
+                    self.creds = refresh_user_credentials(self.user_id, self.creds)
+                    token_refresher.track(self.user_id, self.creds)
                     return True
                 except Exception as e:
-                    print(f"[CALENDAR] Token refresh failed: {e}")
+                    if token_refresher_module.is_permanent_refresh_error(e):
+                        token_refresher.forget(self.user_id)
+                        _discard_credentials(self.user_id, e)
+                        self.creds = None
+                    else:
+                        logger.warning("token refresh failed", extra={"user_id": self.user_id, "error": str(e)})
                     return False
             return False
         return True
@@ -91,7 +175,7 @@ class GoogleCalendarService:
             try:
                 return json.loads(os.getenv('GOOGLE_CLIENT_SECRET'))
             except Exception as e:
-                print(f"Error parsing GOOGLE_CLIENT_SECRET: {e}")
+                logger.error("error parsing GOOGLE_CLIENT_SECRET", extra={"error": str(e)})
         
         # Fallback to file
         current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -133,7 +217,7 @@ class GoogleCalendarService:
             )
             
         auth_url, _ = flow.authorization_url(prompt='consent', access_type='offline', state=self.user_id)
-        print(f"[CALENDAR] Generated auth URL with state={self.user_id}")
+        logger.debug("generated auth URL", extra={"user_id": self.user_id})
         return auth_url
 
     def save_token_from_code(self, code):
@@ -163,11 +247,34 @@ class GoogleCalendarService:
             )
         flow.fetch_token(code=code)
         self.creds = flow.credentials
+        # A different account may now be connected
+        free_busy_cache.invalidate(self.user_id)
         
         # Save to Firestore and local file
         self._save_credentials()
 
-    def create_event(self, summary, description, start_time_str, duration_mins=60, timezone='UTC'):
+    def find_free_slot(self, service, earliest, duration_mins):
+        """
+        First conflict-free start at or after `earliest`, from the cached free/busy index.
+        Returns `earliest` itself when it is free; otherwise the next SLOT_STEP clock
+        boundary in `earliest`'s time zone that fits within MAX_SLOT_SHIFT and
+        DAY_WINDOW, or None if there is none.
+        """
+        duration = datetime.timedelta(minutes=duration_mins)
+        index = free_busy_cache.get(self.user_id, service, earliest, earliest + MAX_SLOT_SHIFT + duration)
+        if index.is_free(earliest, earliest + duration):
+            return earliest
+        slot = index.next_free(earliest, duration, SLOT_STEP, max_shift=MAX_SLOT_SHIFT, day_window=DAY_WINDOW)
+        return slot.astimezone(earliest.tzinfo) if slot else None
+
+    def create_event(self, summary, description, start_time_str, duration_mins=60, timezone='UTC', on_conflict=None):
+        """
+        Inserts an event. `on_conflict` decides what happens when the start overlaps an
+        existing event: "suggest" books nothing and returns status "conflict" with the
+        nearest free `suggested` start for the user to choose; "move" (only for times
+        the user didn't pick) books that slot and reports `moved_from`. By default
+        the event is booked as requested.
+        """
         if not self.is_authorized():
             return {"status": "error", "message": "Not authorized"}
 
@@ -179,38 +286,64 @@ class GoogleCalendarService:
             except ValueError:
                 return {"status": "error", "message": f"Invalid date format: '{start_time_str}'. Expected ISO format (YYYY-MM-DDTHH:MM:SS)"}
 
-            end_time = start_time + datetime.timedelta(minutes=duration_mins)
+            if start_time.tzinfo is None:
+                start_time = start_time.replace(tzinfo=_zone(timezone))
 
-            event = {
-                'summary': summary,
-                'description': description,
-                'start': {
-                    'dateTime': start_time.isoformat(),
-                    'timeZone': timezone,
-                },
-                'end': {
-                    'dateTime': end_time.isoformat(),
-                    'timeZone': timezone,
-                },
-            }
+            # Lookup, insert and record_busy under one per-user lock: tool calls from one
+            # model turn run in parallel and must not both book the same free slot
+            with free_busy_cache.user_lock(self.user_id):
+                requested_time = start_time
+                if on_conflict:
+                    try:
+                        slot = self.find_free_slot(service, start_time, duration_mins)
+                    except Exception as e:
+                        # Availability is an optimization; book as requested if it can't be read
+                        logger.warning("free/busy lookup failed", extra={"user_id": self.user_id, "error": str(e)})
+                        slot = start_time
+                    if slot is None or (slot != start_time and on_conflict != "move"):
+                        return {
+                            "status": "conflict",
+                            "requested": requested_time.isoformat(),
+                            "suggested": slot.isoformat() if slot else None,
+                            "message": "The requested time overlaps an existing event. Nothing was booked; "
+                                       + (f"the nearest free slot is {slot.isoformat()}." if slot else
+                                          f"no free {duration_mins}-minute slot within {MAX_SLOT_SHIFT.total_seconds() / 3600:g} hours during the day."),
+                        }
+                    start_time = slot
 
-            event = service.events().insert(calendarId='primary', body=event).execute()
-            return {"status": "success", "event_id": event.get('id'), "link": event.get('htmlLink')}
+                end_time = start_time + datetime.timedelta(minutes=duration_mins)
+
+                event = {
+                    'summary': summary,
+                    'description': description,
+                    'start': {
+                        'dateTime': start_time.isoformat(),
+                        'timeZone': timezone,
+                    },
+                    'end': {
+                        'dateTime': end_time.isoformat(),
+                        'timeZone': timezone,
+                    },
+                }
+
+                event = service.events().insert(calendarId='primary', body=event).execute()
+                free_busy_cache.record_busy(self.user_id, start_time, end_time)
+
+                result = {"status": "success", "event_id": event.get('id'), "link": event.get('htmlLink'), "start": start_time.isoformat()}
+                if start_time != requested_time:
+                    result["moved_from"] = requested_time.isoformat()
+                    result["reason"] = "Requested time overlapped an existing event"
+                return result
 
         except HttpError as error:
             return {"status": "error", "message": str(error)}
 
     def block_time(self, reason, duration_mins):
         # Use user's timezone instead of UTC
-        try:
-            from zoneinfo import ZoneInfo
-        except ImportError:
-            from backports.zoneinfo import ZoneInfo
-        
-        tz = ZoneInfo(self.current_user_timezone) if self.current_user_timezone else ZoneInfo('UTC')
-        now = datetime.datetime.now(tz).replace(microsecond=0)
+        tz = _zone(self.current_user_timezone)
+        now = datetime.datetime.now(tz).replace(second=0, microsecond=0)
         
-        # Block from next available 15-min slot
+        # Block from the next 15-min boundary, or the first free one after it
         minutes_until_next_slot = 15 - (now.minute % 15)
         start_time = now + datetime.timedelta(minutes=minutes_until_next_slot)
         
@@ -219,5 +352,6 @@ class GoogleCalendarService:
             description="Automated health block generated by your Bio-Twin agent.",
             start_time_str=start_time.isoformat(),
             duration_mins=duration_mins,
-            timezone=self.current_user_timezone
+            timezone=self.current_user_timezone,
+            on_conflict="move"
         )
@@ -0,0 +1,103 @@
+import json
+import base64
+import hashlib
+import datetime
+
+# Fields list views need; `details` and `correlations` are only sent when asked for
+DEFAULT_FIELDS = ["status", "hydration", "score", "velocity", "riskFactor", "lastScan", "timestamp"]
+ALL_FIELDS = DEFAULT_FIELDS + ["details", "correlations", "user_id"]
+MAX_PAGE_SIZE = 100
+# Same path as firestore.FieldPath.document_id(); tie-breaker for equal timestamps
+DOCUMENT_ID = "__name__"
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def encode_cursor(timestamp: datetime.datetime, doc_id: str) -> str:
+    """Opaque cursor holding the ordering values (timestamp, id) of a page's last document."""
+    payload = {"ts": timestamp.isoformat(), "id": doc_id}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """(timestamp, doc_id) from `encode_cursor`."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.datetime.fromisoformat(payload["ts"]), str(payload["id"])
+    except Exception:
+        raise InvalidQuery("Invalid cursor")
+
+
+def parse_fields(fields: str = None) -> list:
+    if not fields:
+        return list(DEFAULT_FIELDS)
+    if fields == "all":
+        return list(ALL_FIELDS)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in ALL_FIELDS]
+    if unknown:
+        raise InvalidQuery(f"Unknown fields: {', '.join(unknown)}")
+    # Always project the ordering field so cursors and time filters work
+    return requested if "timestamp" in requested else requested + ["timestamp"]
+
+
+def parse_time(value: str = None):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise InvalidQuery(f"Invalid ISO timestamp: {value}")
+
+
+def fetch_page(db, user_id: str, limit: int = 20, cursor: str = None, fields: list = None,
+               since: datetime.datetime = None, until: datetime.datetime = None) -> dict:
+    """
+    One page of `users/{user_id}/healthScans`, newest first.
+    Pagination is cursor based: the cursor carries the previous page's last
+    (timestamp, id), and the query starts after those values, so deep pages cost
+    the same as the first one and no extra document read is needed.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    fields = fields or list(DEFAULT_FIELDS)
+    collection = db.collection('users').document(user_id).collection('healthScans')
+
+    query = collection
+    if since or until:
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        if since:
+            query = query.where(filter=FieldFilter('timestamp', '>=', since))
+        if until:
+            query = query.where(filter=FieldFilter('timestamp', '<', until))
+    query = query.order_by('timestamp', direction='DESCENDING') \
+        .order_by(DOCUMENT_ID, direction='DESCENDING').select(fields)
+
+    if cursor:
+        timestamp, doc_id = decode_cursor(cursor)
+        query = query.start_after({'timestamp': timestamp, DOCUMENT_ID: doc_id})
+
+    # One extra document tells us whether another page exists
+    docs = list(query.limit(limit + 1).stream())
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    items = [{"id": doc.id, **doc.to_dict()} for doc in docs]
+    return {
+        "items": items,
+        "next_cursor": encode_cursor(items[-1]["timestamp"], docs[-1].id) if has_more else None,
+    }
+
+
+def page_etag(body: bytes) -> str:
+    """Weak ETag over the serialized page (serialize with sorted keys so it is stable)."""
+    return f'W/"{hashlib.sha1(body).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
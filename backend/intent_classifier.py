@@ -0,0 +1,148 @@
+import re
+import time
+import threading
+from collections import namedtuple
+
+# Same wording the system instruction asks the model to use for off-topic questions
+REFUSAL = "I'm Bio-Twin, your health assistant. I can only help with health, wellness, and medical questions. Please ask me something related to your health!"
+
+GREETING = "greeting"
+OFF_TOPIC = "off_topic"
+SIMPLE = "simple"
+COMPLEX = "complex"
+
+Intent = namedtuple("Intent", ["label", "local_reply", "score"])
+
+_GREETINGS = {
+    "hi", "hii", "hello", "hey", "heya", "hiya", "yo", "greetings", "howdy",
+    "good morning", "good afternoon", "good evening", "good night",
+    "how are you", "how are you doing", "how's it going", "what's up", "sup",
+    "nice to meet you", "thanks", "thank you", "thank you so much", "thx", "ok thanks",
+    "bye", "goodbye", "see you", "see ya",
+}
+
+# Words that may pad a greeting without changing its meaning ("hi there bio-twin!")
+_FILLER = {"there", "bio", "twin", "biotwin", "bio-twin", "buddy", "friend", "again", "so", "much", "very", "a", "lot", "today", "all"}
+
+_HEALTH_TERMS = {
+    # body & symptoms
+    "health", "healthy", "medical", "medicine", "doctor", "symptom", "symptoms", "pain", "ache", "headache",
+    "fever", "cough", "cold", "flu", "fatigue", "tired", "dizzy", "nausea", "sleep", "insomnia", "nap",
+    "stress", "anxiety", "mood", "depression", "heart", "blood", "pressure", "sugar", "diabetes", "weight",
+    "bmi", "skin", "hair", "injury", "allergy", "immune", "hydration", "water", "dehydrated", "energy",
+    # labs & biomarkers
+    "vitamin", "cholesterol", "ldl", "hdl", "triglycerides", "hba1c", "glucose", "insulin", "thyroid",
+    "tsh", "iron", "ferritin", "hemoglobin", "cortisol", "biomarker", "biomarkers", "report", "scan",
+    "lab", "test", "results", "score", "risk", "deficiency", "level", "levels",
+    # lifestyle
+    "diet", "nutrition", "protein", "calories", "meal", "eat", "eating", "food", "fasting", "exercise",
+    "workout", "fitness", "run", "running", "walk", "steps", "yoga", "meditation", "wellness", "wellbeing",
+    # care & actions
+    "appointment", "checkup", "supplement", "supplements", "medication", "dose", "treatment", "therapy",
+    "prescription", "clinic", "hospital",
+}
+
+# Body parts and complaints: any of these means the message may well be about health
+_BODY_TERMS = {
+    "hurt", "hurts", "hurting", "sore", "swollen", "swelling", "itch", "itches", "itchy", "rash", "bite",
+    "sting", "bleeding", "bruise", "burn", "sprain", "sprained", "broken", "fracture", "accident", "sick",
+    "ill", "vomit", "vomiting", "breath", "breathing", "numb", "tingling", "cramp", "cramps", "infection",
+    "head", "neck", "back", "shoulder", "arm", "elbow", "wrist", "hand", "finger", "chest", "stomach",
+    "belly", "hip", "leg", "knee", "ankle", "foot", "feet", "toe", "eye", "eyes", "ear", "throat", "tooth",
+}
+
+# Only these explicit requests are refused locally. Single off-topic words ("flight",
+# "laptop", "football") show up in plenty of health questions, so those go to the model.
+_OFF_TOPIC_PHRASES = ("who won", "capital of", "write a poem", "tell me a joke", "write code", "stock price")
+
+# Anything that asks for reasoning, trends or an action needs the stronger model (and its tools)
+_COMPLEX_TERMS = {
+    "why", "explain", "compare", "trend", "trends", "analyze", "analyse", "correlation", "history",
+    "plan", "schedule", "book", "block", "order", "remind", "recommend", "should", "improve", "over",
+}
+
+_GREETING_REPLIES = {
+    "thanks": "You're welcome! Let me know if there's anything else about your health I can help with.",
+    "bye": "Take care! I'm here whenever you want to check in on your health.",
+    "how": "I'm doing great, thanks for asking! How are you feeling today? I can help with your health reports, sleep, nutrition or booking a check-up.",
+}
+_DEFAULT_GREETING_REPLY = "Hi! I'm Bio-Twin, your health assistant. How can I help with your health today?"
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+(?:-[a-z0-9']+)*")
+
+
+def _tokens(text: str):
+    return _TOKEN_RE.findall(text.lower())
+
+
+class IntentClassifier:
+    """
+    Keyword/ngram router in front of GeminiAgent.reply.
+    Greetings and clearly off-topic questions are answered locally; health
+    questions are tiered into SIMPLE (cheap model) or COMPLEX (primary model).
+    Refusing is only done on explicit off-topic phrases; anything else goes to the model.
+    Only call `classify` when routing is on, since `stats` counts every result as routed.
+    """
+
+    def __init__(self, complex_min_tokens: int = 25):
+        self.complex_min_tokens = complex_min_tokens
+        self.counts = {GREETING: 0, OFF_TOPIC: 0, SIMPLE: 0, COMPLEX: 0}
+        self.total_classify_s = 0.0
+        self.lock = threading.Lock()
+
+    def classify(self, text: str, has_context: bool = False) -> Intent:
+        started = time.perf_counter()
+        intent = self._classify(text or "", has_context)
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.counts[intent.label] += 1
+            self.total_classify_s += elapsed
+        return intent
+
+    def _classify(self, text: str, has_context: bool) -> Intent:
+        tokens = _tokens(text)
+        bigrams = {" ".join(pair) for pair in zip(tokens, tokens[1:])}
+        trigrams = {" ".join(tri) for tri in zip(tokens, tokens[1:], tokens[2:])}
+        normalized = " ".join(tokens)
+
+        health_hits = sum(1 for token in tokens if token in _HEALTH_TERMS or token in _BODY_TERMS)
+        phrase_hits = sum(1 for phrase in _OFF_TOPIC_PHRASES if phrase in normalized)
+
+        # Greeting: every token belongs to a greeting phrase or is filler
+        greeting_tokens = set()
+        for gram in set(tokens) | bigrams | trigrams:
+            if gram in _GREETINGS:
+                greeting_tokens.update(gram.split())
+        if greeting_tokens and all(token in greeting_tokens or token in _FILLER for token in tokens):
+            return Intent(GREETING, self._greeting_reply(greeting_tokens), 1.0)
+
+        if phrase_hits and not health_hits:
+            return Intent(OFF_TOPIC, REFUSAL, float(phrase_hits))
+
+        complex_hits = sum(1 for token in tokens if token in _COMPLEX_TERMS)
+        if complex_hits or len(tokens) >= self.complex_min_tokens or (has_context and health_hits > 1):
+            return Intent(COMPLEX, None, float(health_hits))
+        return Intent(SIMPLE, None, float(health_hits))
+
+    def _greeting_reply(self, greeting_tokens: set) -> str:
+        if greeting_tokens & {"thanks", "thank", "thx"}:
+            return _GREETING_REPLIES["thanks"]
+        if greeting_tokens & {"bye", "goodbye", "see", "ya"}:
+            return _GREETING_REPLIES["bye"]
+        if "how" in greeting_tokens:
+            return _GREETING_REPLIES["how"]
+        return _DEFAULT_GREETING_REPLY
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = sum(self.counts.values())
+            avoided = self.counts[GREETING] + self.counts[OFF_TOPIC]
+            return {
+                **self.counts,
+                "total": total,
+                "call_avoidance_rate": avoided / total if total else 0.0,
+                "avg_classify_us": self.total_classify_s / total * 1e6 if total else 0.0,
+            }
+
+
+classifier = IntentClassifier()
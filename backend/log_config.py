@@ -0,0 +1,146 @@
+import os
+import sys
+import uuid
+import zlib
+import queue
+import atexit
+import logging
+import logging.handlers
+import contextvars
+import datetime
+
+import orjson
+
+# Correlation id of the request being handled (set by RequestIdMiddleware; copied
+# into threadpool and asyncio.to_thread calls along with the rest of the context)
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of requests whose DEBUG events are kept (whole requests, not single lines)
+DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.05"))
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+_STANDARD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "request_id"}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, request_id plus any `extra=` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return orjson.dumps(entry, default=str).decode()
+
+
+class ContextFilter(logging.Filter):
+    """Stamps the request id and drops DEBUG events from unsampled requests."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = request_id_var.get()
+        record.request_id = request_id
+        if record.levelno <= logging.DEBUG and DEBUG_SAMPLE_RATE < 1.0:
+            # Hashing the request id keeps or drops a request's debug trace as a whole
+            bucket = zlib.crc32((request_id or record.name).encode()) % 10000
+            return bucket < DEBUG_SAMPLE_RATE * 10000
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the background listener; drops (and counts) them if the queue is full."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Merge args in place instead of the stdlib copy + format; the listener formats
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+_listener = None
+
+
+def setup_logging():
+    """Routes the root logger through a bounded queue to a background stdout writer. Idempotent."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JSONFormatter())
+
+    log_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"biotwin.{name}")
+
+
+class RequestIdMiddleware:
+    """ASGI middleware: reuses X-Request-ID or creates one, and echoes it on the response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode()[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-request-id", request_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
+
+
+def stats() -> dict:
+    return {
+        "level": LOG_LEVEL,
+        "debug_sample_rate": DEBUG_SAMPLE_RATE,
+        "queued": _listener.queue.qsize() if _listener else 0,
+        "dropped": NonBlockingQueueHandler.dropped,
+    }
@@ -1,7 +1,10 @@
-from fastapi import FastAPI, UploadFile, File, Request, HTTPException
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-import shutil
+import asyncio
+import hashlib
 import os
 import uuid
 import warnings
@@ -15,8 +18,21 @@ import twin_agent
 import memory
 import firebase_config
 import google_calendar
-
-app = FastAPI(title="Bio-Twin Backend")
+import intent_classifier
+import admission
+import singleflight
+import write_behind
+import health_history
+import cohort_analytics
+import fast_json
+import twin_events
+import log_config
+
+log_config.setup_logging()
+logger = log_config.get_logger("api")
+
+# orjson-backed responses app-wide (handles Firestore timestamps)
+app = FastAPI(title="Bio-Twin Backend", default_response_class=fast_json.FastJSONResponse)
 
 # CORS Configuration
 origins = [
@@ -28,6 +44,16 @@ origins = [
 if os.getenv("FRONTEND_URL"):
     origins.append(os.getenv("FRONTEND_URL"))
 
+# Admission control (per-endpoint limits, fair queues, load shedding).
+# Registered before CORS so shed 429/503 responses still carry CORS headers.
+app.add_middleware(admission.AdmissionMiddleware)
+
+# Negotiated brotli/gzip for large JSON bodies
+app.add_middleware(fast_json.CompressionMiddleware)
+
+# Correlation ids for structured logs (X-Request-ID in and out)
+app.add_middleware(log_config.RequestIdMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins, 
@@ -35,6 +61,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
 # Ensure uploads dir exists
@@ -60,66 +87,182 @@ def get_user_id(request_data: dict = None, query_param: str = None) -> str:
 # This ensures conversation continuity WITHOUT permanent DB storage
 user_sessions = {}
 
+@app.exception_handler(admission.Overloaded)
+async def overloaded_handler(request: Request, error: admission.Overloaded):
+    # Shed by admission.admit inside an endpoint; same response the middleware sends
+    return JSONResponse(error.body(), status_code=error.status_code, headers=error.headers())
+
+
 @app.get("/")
 def home():
     return {"message": "Bio-Twin Agentic Health System is Running"}
 
+TWIN_HEARTBEAT_S = float(os.getenv("TWIN_HEARTBEAT_S", "30"))
+
+# Concurrent identical requests share one execution (double-clicked uploads, parallel mount-time fetches)
+scan_flight = singleflight.SingleFlight("scan")
+latest_scan_flight = singleflight.SingleFlight("latest-scan")
+
+def _fetch_latest_scan(user_id: str):
+    # Query latest scan for this user
+    docs = firebase_config.db.collection('users').document(user_id).collection('healthScans')\
+        .order_by('timestamp', direction='DESCENDING').limit(1).stream()
+
+    for doc in docs:
+        return doc.to_dict()
+    return None
+
+# Latest scan per user, kept as ready-to-send JSON bytes; dropped when a new scan is flushed
+health_data_cache = fast_json.PayloadCache(ttl_s=float(os.getenv("HEALTH_DATA_CACHE_TTL_S", "30")))
+
 @app.get("/health-data")
 def get_health_data(user_id: str = "guest_user"):
     # Read from Firestore
     if firebase_config.db:
         try:
-            # Query latest scan for this user
-            docs = firebase_config.db.collection('users').document(user_id).collection('healthScans')\
-                .order_by('timestamp', direction='DESCENDING').limit(1).stream()
-            
-            for doc in docs:
-                return doc.to_dict()
+            body = health_data_cache.get_or_build(
+                user_id, lambda: latest_scan_flight.do(user_id, _fetch_latest_scan, user_id)
+            )
+            return fast_json.json_bytes_response(body)
         except Exception as e:
-            print(f"Error fetching health data: {e}")
+            logger.error("error fetching health data", extra={"user_id": user_id, "error": str(e)})
             return None
     return None
 
-@app.post("/scan")
-def scan_endpoint(file: UploadFile = File(...), user_id: str = "guest_user"):
-    # 🛡️ Sentinel: Prevent Path Traversal by sanitizing the filename and using a UUID
-    secure_filename = f"{uuid.uuid4().hex}_{os.path.basename(file.filename)}"
-    file_location = os.path.join("uploads", secure_filename)
+@app.get("/health-history")
+def get_health_history(request: Request, user_id: str = "guest_user", limit: int = 20, cursor: str = None,
+                       fields: str = None, since: str = None, until: str = None):
+    """
+    Pages through the user's scans, newest first.
+    `cursor` comes from the previous page's `next_cursor`; `fields` is a comma list
+    (or "all") and defaults to the list-view fields; `since`/`until` are ISO timestamps.
+    Responses carry an ETag, and a matching If-None-Match returns 304 with no body.
+    """
+    if not firebase_config.db:
+        return {"items": [], "next_cursor": None}
 
+    try:
+        page = health_history.fetch_page(
+            firebase_config.db, user_id,
+            limit=limit,
+            cursor=cursor,
+            fields=health_history.parse_fields(fields),
+            since=health_history.parse_time(since),
+            until=health_history.parse_time(until),
+        )
+    except health_history.InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    body = fast_json.dumps(page, sort_keys=True)
+    etag = health_history.page_etag(body)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if health_history.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return fast_json.json_bytes_response(body, headers=headers)
+
+# Precomputed by `python cohort_analytics.py`; served as stored bytes from the local
+# file, or from Firestore when this instance's file is missing or stale
+cohort_summary_cache = cohort_analytics.SummaryCache(db=firebase_config.db)
+
+@app.get("/cohort-summary")
+def get_cohort_summary():
+    body = cohort_summary_cache.get()
+    if body is None:
+        return JSONResponse({"error": "Cohort summary not computed yet"}, status_code=404)
+    return Response(content=body, media_type="application/json")
+
+def _save_upload(file: UploadFile, file_location: str) -> str:
+    """Writes the upload to disk and returns its SHA-256 digest."""
+    digest = hashlib.sha256()
     with open(file_location, "wb+") as file_object:
-        shutil.copyfileobj(file.file, file_object)
-    
-    result = scanner.scan_document(file_location)
-    
+        for chunk in iter(lambda: file.file.read(1024 * 1024), b""):
+            digest.update(chunk)
+            file_object.write(chunk)
+    return digest.hexdigest()
+
+# Scan results are persisted write-behind: the response never waits on Firestore,
+# and unflushed writes survive restarts in the spool file.
+scan_writer = write_behind.WriteBehindQueue(
+    firebase_config.db,
+    spool_path=os.getenv("SCAN_SPOOL_PATH", "scan_writes.spool"),
+    batch_size=int(os.getenv("SCAN_WRITE_BATCH", "50")),
+    flush_interval_s=float(os.getenv("SCAN_WRITE_FLUSH_S", "1.0")),
+    on_flushed=lambda jobs: _on_scans_flushed(jobs),
+) if firebase_config.db else None
+
+def _on_scans_flushed(jobs: list):
+    # Runs on the write-behind thread once scans are durably in Firestore
+    for job in jobs:
+        user_id = job["path"][1]
+        health_data_cache.invalidate(user_id)
+        # Push the new state to the user's open twin connections
+        twin_events.hub.publish(user_id, "health_state", job["data"])
+
+def _save_health_scan(user_id: str, health_data: dict):
+    if scan_writer:
+        from datetime import datetime
+        health_doc = {
+            **health_data,
+            "timestamp": datetime.now()
+        }
+        scan_writer.enqueue(('users', user_id, 'healthScans'), health_doc)
+        logger.debug("health data queued for Firestore", extra={"user_id": user_id})
+
+async def _scan_and_persist(file_location: str, user_id: str):
+    twin_events.hub.publish(user_id, "scan_progress", {"stage": "scanning"})
+
+    # Async scan: retry waits run on the event loop instead of parking a worker thread
+    result = await scanner.scan_document_async(file_location)
+
     # Persist the result in DB
     if "error" not in result:
-        health_data = {
-            "status": result.get("overall_status") or "Neutral",
-            "hydration": result.get("hydration_level") or "Medium",
-            "lastScan": "Just Now",
-            "details": result.get("summary") or "Analysis complete.",
-            "score": result.get("health_score") or "--",
-            "velocity": result.get("velocity") or "Unknown",
-            "riskFactor": result.get("primary_risk") or "None",
-            "correlations": result.get("correlations") or [],
-            "user_id": user_id
-        }
-        
-        # Save to Firestore
-        if firebase_config.db:
-            try:
-                from datetime import datetime
-                health_doc = {
-                    **health_data,
-                    "timestamp": datetime.now()
-                }
-                firebase_config.db.collection('users').document(user_id).collection('healthScans').add(health_doc)
-                print(f"Health data saved to Firestore for {user_id}")
-            except Exception as e:
-                print(f"Error saving to Firestore: {e}")
-    
+        health_data = scanner.to_health_data(result, user_id)
+        twin_events.hub.publish(user_id, "scan_progress", {"stage": "saving"})
+
+        # Save to Firestore (health_state is pushed once the write is flushed)
+        await run_in_threadpool(_save_health_scan, user_id, health_data)
+        if not scan_writer:
+            twin_events.hub.publish(user_id, "health_state", health_data)
+    else:
+        twin_events.hub.publish(user_id, "scan_progress", {"stage": "failed", "error": result["error"]})
+
     return result
 
+# Push channel: the twin subscribes here instead of polling /health-data
+@app.websocket("/ws/twin")
+async def twin_updates(websocket: WebSocket, user_id: str = "guest_user"):
+    await websocket.accept()
+    queue = twin_events.hub.subscribe(user_id)
+    try:
+        # Current state first, then every update as it happens
+        current = await run_in_threadpool(get_health_data, user_id)
+        state = current.body if isinstance(current, Response) else fast_json.dumps(current)
+        await websocket.send_text(f'{{"type":"health_state","data":{state.decode()}}}')
+
+        while True:
+            try:
+                payload = await asyncio.wait_for(queue.get(), timeout=TWIN_HEARTBEAT_S)
+            except asyncio.TimeoutError:
+                # Heartbeat also surfaces dead idle connections so they get cleaned up
+                payload = '{"type":"ping"}'
+            await websocket.send_text(payload)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        twin_events.hub.unsubscribe(user_id, queue)
+
+@app.post("/scan")
+async def scan_endpoint(file: UploadFile = File(...), user_id: str = "guest_user"):
+    # 🛡️ Sentinel: Prevent Path Traversal by sanitizing the filename and using a UUID
+    secure_filename = f"{uuid.uuid4().hex}_{os.path.basename(file.filename)}"
+    file_location = os.path.join("uploads", secure_filename)
+
+    digest = await run_in_threadpool(_save_upload, file, file_location)
+    twin_events.hub.publish(user_id, "scan_progress", {"stage": "uploaded"})
+
+    # Same user + same bytes already scanning: share that run (and its single Firestore write)
+    return await scan_flight.do_async((user_id, digest), _scan_and_persist, file_location, user_id)
+
 @app.get("/auth/google")
 def google_auth(user_id: str = "guest_user"):
     # Check credentials
@@ -139,7 +282,7 @@ def google_auth(user_id: str = "guest_user"):
 def google_callback(code: str, state: str = None):
     # Extract user_id from state parameter (passed during auth URL generation)
     user_id = state if state else "guest_user"
-    print(f"[AUTH CALLBACK] Received code for user_id: {user_id}")
+    logger.info("auth callback received", extra={"user_id": user_id})
     
     service = google_calendar.GoogleCalendarService(user_id=user_id)
     try:
@@ -147,7 +290,7 @@ def google_callback(code: str, state: str = None):
         from fastapi.responses import RedirectResponse
         return RedirectResponse(url=f"{os.getenv('FRONTEND_URL', 'http://localhost:5173')}/?auth=success")
     except Exception as e:
-        print(f"[AUTH CALLBACK ERROR] {e}")
+        logger.error("auth callback failed", extra={"user_id": user_id, "error": str(e)})
         return {"error": str(e)}
 
 @app.get("/auth/status")
@@ -208,10 +351,11 @@ class AgentRequest(BaseModel):
     user_id: str = "guest_user"
 
 @app.post("/agent-act")
-def run_agent(request: AgentRequest):
-    # stateless agent
-    agent = twin_agent.GeminiAgent(user_id=request.user_id)
-    response = agent.run(request.metrics)
+async def run_agent(request: AgentRequest):
+    # stateless agent, drawn from the warm pool and bound to this user
+    async with admission.admit("/agent-act", request.user_id):
+        with twin_agent.agent_pool.checkout(request.user_id) as agent:
+            response = await agent.run(request.metrics)
     return {"agent_response": response}
 
 class ChatRequest(BaseModel):
@@ -219,30 +363,27 @@ class ChatRequest(BaseModel):
     context: dict | None = None
 
 @app.post("/chat")
-def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest):
     user_id = get_user_id(request.dict())
     
     
-    print(f"DEBUG: Chat request from user_id={user_id}")
-    
     # Initialize Agent from In-Memory Session Store
     if user_id in user_sessions:
-        print("DEBUG: Using existing agent session")
         agent = user_sessions[user_id]
     else:
-        print("DEBUG: Creating new agent session")
+        logger.debug("creating agent session", extra={"user_id": user_id})
         # Create new agent and store in session
         agent = twin_agent.GeminiAgent(user_id=user_id)
         user_sessions[user_id] = agent
     
-    # Get Reply
-    print(f"DEBUG: Sending message to agent: {request.message[:50]}...")
-    try:
-        response_text = agent.reply(request.message, context=request.context)
-        print(f"DEBUG: Agent response: {str(response_text)[:50]}...")
-    except Exception as e:
-        print(f"ERROR in agent.reply: {e}")
-        response_text = "I encountered an error processing your request."
+    # Get Reply (admitted per user now that the body has been parsed)
+    async with admission.admit("/chat", user_id):
+        try:
+            response_text = await agent.reply(request.message, context=request.context)
+            logger.debug("chat reply sent", extra={"user_id": user_id, "reply_chars": len(str(response_text))})
+        except Exception:
+            logger.exception("agent.reply failed", extra={"user_id": user_id})
+            response_text = "I encountered an error processing your request."
     
     # Note: We do NOT save history to DB anymore, as per user request.
     # History persists in memory within the `agent` instance in `user_sessions`.
@@ -266,7 +407,7 @@ def get_google_auth_url(user_id: str = "guest_user"):
         auth_url = service.get_auth_url()
         return {"url": auth_url}
     except Exception as e:
-        print(f"Error generating auth URL: {e}")
+        logger.error("error generating auth URL", extra={"user_id": user_id, "error": str(e)})
         return {"error": str(e), "message": "Calendar feature not available (check server logs)."}
 
 @app.get("/auth/callback")
@@ -275,7 +416,7 @@ def auth_callback(code: str, state: str = "guest_user"):
     Handle the redirect from Google. Exchange code for token.
     """
     try:
-        print(f"Received auth callback for user: {state}")
+        logger.info("auth callback received", extra={"user_id": state})
         service = google_calendar.GoogleCalendarService(user_id=state)
         service.save_token_from_code(code)
         
@@ -289,7 +430,7 @@ def auth_callback(code: str, state: str = "guest_user"):
             "action": "Close this window and return to the app."
         }
     except Exception as e:
-        print(f"Auth callback failed: {e}")
+        logger.error("auth callback failed", extra={"user_id": state, "error": str(e)})
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/auth/status")
@@ -303,11 +444,21 @@ def get_auth_status(user_id: str = "guest_user"):
 # Debug Endpoints remain same
 @app.on_event("startup")
 async def startup_event():
+    twin_events.hub.bind(asyncio.get_running_loop())
+    google_calendar.token_refresher.start()
+    if scan_writer:
+        scan_writer.start()
     key = os.getenv("GEMINI_API_KEY")
     if key:
-        print(f"🔑 DEBUG: Loaded API Key. Length: {len(key)}")
+        logger.info("Gemini API key loaded")
     else:
-        print("❌ DEBUG: No API Key found.")
+        logger.warning("no Gemini API key found")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    google_calendar.token_refresher.stop()
+    if scan_writer:
+        scan_writer.stop()
 
 @app.get("/debug/config")
 def debug_config():
@@ -316,6 +467,56 @@ def debug_config():
          return {"status": "error"}
     return {"status": "ok", "key_length": len(key), "key_end": key[-4:]}
 
+@app.get("/debug/scan-stats")
+def debug_scan_stats():
+    return {
+        "hedging_enabled": scanner.SCAN_HEDGING,
+        "hedge_delay_s": round(scanner.hedge_delay(), 2),
+        **scanner.hedge_budget.stats(),
+    }
+
+@app.get("/debug/agent-pool")
+def debug_agent_pool():
+    return twin_agent.agent_pool.stats()
+
+@app.get("/debug/intent-stats")
+def debug_intent_stats():
+    return intent_classifier.classifier.stats()
+
+@app.get("/debug/admission")
+def debug_admission():
+    return admission.stats()
+
+@app.get("/debug/singleflight")
+def debug_singleflight():
+    return {flight.name: flight.stats() for flight in singleflight.registry}
+
+@app.get("/debug/token-refresher")
+def debug_token_refresher():
+    return google_calendar.token_refresher.stats()
+
+@app.get("/debug/write-behind")
+def debug_write_behind():
+    return scan_writer.stats() if scan_writer else {"status": "disabled"}
+
+@app.get("/debug/response-cache")
+def debug_response_cache():
+    return health_data_cache.stats()
+
+@app.get("/debug/twin-events")
+def debug_twin_events():
+    return twin_events.hub.stats()
+
+
+@app.get("/debug/free-busy")
+def debug_free_busy():
+    return google_calendar.free_busy_cache.stats()
+
+
+@app.get("/debug/logging")
+def debug_logging():
+    return log_config.stats()
+
 @app.get("/debug/oauth-config")
 def debug_oauth_config():
     import os
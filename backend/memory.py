@@ -1,46 +1,175 @@
-import google.generativeai as genai
-from app_secrets import GEMINI_API_KEY
+"""
+Bulk import of a user's historical medical records.
+
+    python memory.py <archive_dir> --user <user_id> [--concurrency 4] [--checkpoint path]
+
+Walks the archive lazily, skips files whose content hash was already imported
+(in this run or a previous, interrupted one), scans the rest with bounded
+parallelism and stores one `healthScans` record per report. Progress is
+checkpointed after every file, so re-running the same command resumes.
+"""
+import os
+import sys
+import json
 import time
+import asyncio
+import hashlib
+import argparse
+import datetime
 
-genai.configure(api_key=GEMINI_API_KEY)
+import scanner
 
-def load_history():
-    """
-    Simulates loading a massive context of medical history (5 years of PDFs).
-    Uses Gemini's Long Context window.
-    """
-    print("Loading 5 years of medical history (simulated)...")
-    
-    # In a real scenario, we would upload 50+ PDF files using the File API
-    # and wait for them to process.
-    # history_files = [genai.upload_file(f) for f in glob.glob("history/*.pdf")]
-    
-    # Simulating a large context string for the prototype
-    large_context_simulation = """
-    PATIENT HISTORY SUMMARY DOES NOT REPLACE FULL RECORDS.
-    
-    2021-03-12: Vitamin D: 22 ng/mL (Low). Lipid Profile: Normal.
-    2022-04-15: Vitamin D: 18 ng/mL (Low). Prescribed supplements.
-    2023-01-20: Vitamin D: 25 ng/mL (Borderline).
-    2024-05-10: Vitamin D: 30 ng/mL (Normal).
-    2025-06-05: Vitamin D: 14 ng/mL (Critical Low). Patient reports fatigue.
-    ... [Imagine 1 million tokens of detailed notes here] ...
+SUPPORTED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".webp", ".heic"}
+
+
+def iter_archive(root: str):
+    """Yields supported files under `root` in a stable order (so resumes walk the same way)."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS:
+                yield os.path.join(dirpath, filename)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImportCheckpoint:
+    """Content hashes already handled, persisted atomically after every update."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = json.load(f).get("done", {})
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self.done
+
+    def mark(self, digest: str, entry: dict):
+        self.done[digest] = entry
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"done": self.done}, f)
+        os.replace(tmp_path, self.path)
+
+
+class ImportProgress:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.seen = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.resumed = 0
+        self.failed = 0
+
+    def report(self, path: str, outcome: str):
+        elapsed = time.monotonic() - self.started
+        rate = self.imported / elapsed if elapsed else 0.0
+        print(f"[IMPORT] {self.seen} seen | {self.imported} imported | {self.duplicates + self.resumed} skipped"
+              f" | {self.failed} failed | {rate:.2f}/s | {outcome}: {os.path.basename(path)}")
+
+    def as_dict(self) -> dict:
+        return {
+            "seen": self.seen,
+            "imported": self.imported,
+            "duplicates": self.duplicates,
+            "resumed": self.resumed,
+            "failed": self.failed,
+            "duration_s": round(time.monotonic() - self.started, 2),
+        }
+
+
+def to_import_record(result: dict, user_id: str, path: str, digest: str) -> dict:
+    # The report date is unknown until parsed, so the file's mtime stands in for the scan time
+    taken_at = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+    return {
+        **scanner.to_health_data(result, user_id, last_scan=taken_at.strftime("%Y-%m-%d")),
+        "biomarkers": result.get("biomarkers") or [],
+        "source": "import",
+        "sourceFile": os.path.basename(path),
+        "contentHash": digest,
+        "timestamp": taken_at,
+        "importedAt": datetime.datetime.now(),
+    }
+
+
+async def import_archive(root: str, user_id: str, save, concurrency: int = 4,
+                         checkpoint_path: str = None, on_progress=None) -> dict:
     """
-    
-    model = genai.GenerativeModel("gemini-1.5-pro") # Supports 1M+ context
-    
-    prompt = """
-    Review this entire patient history context. 
-    Identify patterns in Vitamin D levels over the last 5 years.
-    Are there seasonal trends or compliance issues?
+    Imports every report under `root` for `user_id`.
+    `save(doc_id, record)` persists one record; doc ids derive from the content
+    hash, so a re-import overwrites instead of duplicating.
     """
-    
-    print("Sending massive context to Gemini 3 Long Context window...")
-    # Simulate processing delay
-    time.sleep(1) 
-    
-    response = model.generate_content([large_context_simulation, prompt])
-    return response.text
+    checkpoint = ImportCheckpoint(checkpoint_path or os.path.join(root, ".bio_twin_import.json"))
+    progress = ImportProgress()
+    on_progress = on_progress or progress.report
+    files = iter_archive(root)
+    claimed = set()
+
+    async def worker():
+        # Workers share one lazy generator, so the archive is never listed up front
+        for path in files:
+            progress.seen += 1
+            digest = await asyncio.to_thread(file_digest, path)
+
+            if digest in checkpoint:
+                progress.resumed += 1
+                on_progress(path, "already imported")
+                continue
+            if digest in claimed:
+                progress.duplicates += 1
+                on_progress(path, "duplicate")
+                continue
+            claimed.add(digest)
+
+            result = await scanner.scan_document_async(path)
+            if "error" in result:
+                progress.failed += 1
+                on_progress(path, f"failed ({result['error'][:60]})")
+                continue
+
+            doc_id = f"import-{digest[:40]}"
+            await asyncio.to_thread(save, doc_id, to_import_record(result, user_id, path, digest))
+            checkpoint.mark(digest, {"doc_id": doc_id, "file": os.path.relpath(path, root)})
+            progress.imported += 1
+            on_progress(path, "imported")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return progress.as_dict()
+
 
 if __name__ == "__main__":
-    print(load_history())
+    parser = argparse.ArgumentParser(description="Import a folder of historical reports into Bio-Twin")
+    parser.add_argument("archive_dir")
+    parser.add_argument("--user", required=True, help="Bio-Twin user id to import for")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <archive_dir>/.bio_twin_import.json)")
+    args = parser.parse_args()
+
+    import firebase_config
+    import write_behind
+
+    if not firebase_config.db:
+        sys.exit("Firestore is not configured (FIREBASE_CREDENTIALS / serviceAccountKey.json).")
+
+    writer = write_behind.WriteBehindQueue(firebase_config.db, spool_path=os.getenv("IMPORT_SPOOL_PATH", "import_writes.spool"))
+    writer.start()
+    try:
+        summary = asyncio.run(import_archive(
+            args.archive_dir,
+            args.user,
+            save=lambda doc_id, record: writer.enqueue(("users", args.user, "healthScans"), record, doc_id=doc_id, block=True),
+            concurrency=args.concurrency,
+            checkpoint_path=args.checkpoint,
+        ))
+    finally:
+        # Drains queued records; anything unflushed stays in the spool for the next run
+        writer.stop(timeout=60)
+    print(json.dumps(summary, indent=2))
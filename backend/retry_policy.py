@@ -0,0 +1,200 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import inspect
+
+import log_config
+
+logger = log_config.get_logger("retry")
+
+# Error classes used to pick a retry policy
+QUOTA = "quota"          # 429 / ResourceExhausted - usually carries a reset hint
+TRANSIENT = "transient"  # 5xx, timeouts, dropped connections
+FATAL = "fatal"          # bad request, auth, safety blocks - retrying won't help
+
+# Classification is by status code where the error carries one, then by exception
+# type. Types from google-api-core / httpx / requests / urllib3 are matched by class
+# name anywhere in the MRO so this module doesn't have to import them.
+_QUOTA_STATUS = {429}
+_TRANSIENT_STATUS = {408, 500, 502, 503, 504}
+_QUOTA_TYPES = {"ResourceExhausted", "TooManyRequests"}
+_TRANSIENT_TYPES = {
+    "ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "BadGateway", "GatewayTimeout",
+    "ConnectError", "ConnectTimeout", "ReadTimeout", "ReadError", "RemoteProtocolError",
+    "RemoteDisconnected", "ProtocolError", "ChunkedEncodingError", "TransportError",
+}
+
+# Hints Gemini / google-api-core put in error text, e.g.
+#   "Please retry in 37.8s"  /  "retry_delay { seconds: 37 }"  /  "Retry-After: 30"
+_HINT_PATTERNS = (
+    re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE),
+    re.compile(r"retry-after:?\s*([\d.]+)", re.IGNORECASE),
+)
+
+
+def status_code(error: Exception):
+    """HTTP status carried by the error (api-core `.code`, `.status_code`, `.response`, googleapiclient `.resp`), or None."""
+    for value in (
+        getattr(error, "code", None),
+        getattr(error, "status_code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+        getattr(getattr(error, "resp", None), "status", None),
+    ):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.isdigit():
+            return int(value)
+    return None
+
+
+def classify_error(error: Exception) -> str:
+    status = status_code(error)
+    if status in _QUOTA_STATUS:
+        return QUOTA
+    if status in _TRANSIENT_STATUS:
+        return TRANSIENT
+    type_names = {cls.__name__ for cls in type(error).__mro__}
+    if type_names & _QUOTA_TYPES:
+        return QUOTA
+    # Malformed model JSON is worth a re-roll
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError, json.JSONDecodeError)) \
+            or type_names & _TRANSIENT_TYPES:
+        return TRANSIENT
+    return FATAL
+
+
+def retry_after_hint(error: Exception):
+    """Seconds the server asked us to wait (Retry-After / quota reset), or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("Retry-After") or headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+
+    error_str = str(error)
+    for pattern in _HINT_PATTERNS:
+        match = pattern.search(error_str)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class AttemptAbandoned(TimeoutError):
+    """An attempt ran into the deadline and was abandoned; a sync call may still be running in its thread."""
+
+
+class ErrorPolicy:
+    """How to retry one error class."""
+
+    def __init__(self, max_attempts: int = 1, base_delay: float = 1.0, multiplier: float = 2.0,
+                 max_delay: float = 30.0, jitter: tuple = (0.0, 1.0), max_hint_wait: float = 0.0,
+                 require_hint: bool = False):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+        # Longest server-provided hint we are willing to honor; longer hints give up
+        self.max_hint_wait = max_hint_wait
+        # Only retry when the server told us when (quota errors without a reset time fail fast)
+        self.require_hint = require_hint
+
+    def delay(self, attempt: int, hint):
+        """Delay before retry number `attempt` (0-based), or None to give up."""
+        if attempt + 1 >= self.max_attempts:
+            return None
+        if hint is not None:
+            return hint if hint <= self.max_hint_wait else None
+        if self.require_hint:
+            return None
+        backoff = self.base_delay * (self.multiplier ** attempt) + random.uniform(*self.jitter)
+        return min(backoff, self.max_delay)
+
+
+class RetryPolicy:
+    """
+    Deadline-aware retry scheduler.
+    Waits happen on the event loop (asyncio.sleep), and blocking callables run in
+    a worker thread only for the duration of each attempt, so no thread is ever
+    parked sleeping between attempts.
+    """
+
+    def __init__(self, policies: dict, default_deadline: float = None):
+        self.policies = policies
+        self.default_deadline = default_deadline
+
+    def deadline(self, seconds: float = None):
+        """Absolute monotonic deadline `seconds` from now (defaults to the policy budget)."""
+        seconds = self.default_deadline if seconds is None else seconds
+        return None if seconds is None else time.monotonic() + seconds
+
+    async def call(self, fn, *args, deadline: float = None, label: str = "", idempotent: bool = True, **kwargs):
+        """
+        Calls `fn` (sync or async) until it succeeds, its error class stops allowing
+        retries, or the next wait would overrun `deadline`. Re-raises the last error.
+        An attempt cut off by the deadline raises AttemptAbandoned. With
+        `idempotent=False` (e.g. a chat send, which appends to the session when it
+        finishes) such an attempt is never retried, since it may still complete.
+        """
+        attempt = 0
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError(f"{label or 'call'} exceeded its deadline")
+
+            try:
+                if inspect.iscoroutinefunction(fn):
+                    call = fn(*args, **kwargs)
+                else:
+                    call = asyncio.to_thread(fn, *args, **kwargs)
+                task = asyncio.ensure_future(call)
+                done, _ = await asyncio.wait({task}, timeout=remaining)
+                if not done:
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    raise AttemptAbandoned(f"{label or 'call'} abandoned at its deadline")
+                return task.result()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if isinstance(e, AttemptAbandoned) and not idempotent:
+                    logger.warning("non-idempotent call abandoned, not retried", extra={"label": label})
+                    raise
+                error_class = classify_error(e)
+                hint = retry_after_hint(e)
+                policy = self.policies.get(error_class) or self.policies.get(FATAL) or ErrorPolicy()
+                wait_time = policy.delay(attempt, hint)
+
+                if wait_time is None:
+                    raise
+                if deadline is not None and time.monotonic() + wait_time >= deadline:
+                    logger.warning("retry abandoned at deadline", extra={"label": label, "wait_s": round(wait_time, 1)})
+                    raise
+
+                logger.info("retrying", extra={"label": label, "error_class": error_class, "wait_s": round(wait_time, 1)})
+                attempt += 1
+                await asyncio.sleep(wait_time)
+
+
+# Scanner: quota errors move to the next model unless the reset is imminent.
+# Deadline stays under the frontend's 120s upload timeout.
+scan_policy = RetryPolicy({
+    QUOTA: ErrorPolicy(max_attempts=2, max_hint_wait=5, require_hint=True),
+    TRANSIENT: ErrorPolicy(max_attempts=3, base_delay=10, multiplier=1.5, jitter=(2, 5)),
+    FATAL: ErrorPolicy(max_attempts=1),
+}, default_deadline=float(os.getenv("SCAN_DEADLINE_S", "110")))
+
+# Chat / agent: short waits only, a user is watching the spinner.
+chat_policy = RetryPolicy({
+    QUOTA: ErrorPolicy(max_attempts=2, max_hint_wait=3, require_hint=True),
+    TRANSIENT: ErrorPolicy(max_attempts=2, base_delay=1, jitter=(0, 0.5)),
+    FATAL: ErrorPolicy(max_attempts=1),
+}, default_deadline=float(os.getenv("CHAT_DEADLINE_S", "60")))
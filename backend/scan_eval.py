@@ -0,0 +1,216 @@
+"""
+Record/replay evaluation harness for the scanner.
+
+Record real model responses for a corpus once (needs GEMINI_API_KEY):
+    python scan_eval.py record <corpus_dir> --models models/gemini-2.5-flash [--prompt-file p.txt --prompt-version v2]
+
+Replay them offline, as often as needed, through the real scan_document pipeline:
+    python scan_eval.py replay <corpus_dir> [--models ...] [--prompt-version v2] [--simulate-latency]
+
+Responses are stored in <corpus_dir>/cassette.json keyed by model, prompt version and
+file content hash. An optional <corpus_dir>/labels.json ({"file.jpg": {"biomarkers":
+[{"name": ..., "value": ...}]}}) provides ground truth; without it, the first model's
+output is the reference for biomarker agreement.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+import scanner
+import retry_policy
+import memory
+
+# Replay must be deterministic: a given recorded response always produces the same outcome
+NO_RETRY = retry_policy.RetryPolicy({retry_policy.FATAL: retry_policy.ErrorPolicy(max_attempts=1)})
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(model_name: str, prompt_version: str, digest: str) -> str:
+        return f"{model_name}|{prompt_version}|{digest}"
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class _Upload:
+    """What the replaying side passes around instead of a Gemini File handle."""
+
+    def __init__(self, path: str, digest: str, handle=None):
+        self.path = path
+        self.digest = digest
+        self.handle = handle
+
+
+class RecordingTransport(scanner.GeminiTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    def upload(self, image_path: str):
+        return _Upload(image_path, memory.file_digest(image_path), super().upload(image_path))
+
+    async def generate(self, model_name: str, uploaded, prompt_text: str) -> str:
+        started = time.monotonic()
+        text = await super().generate(model_name, uploaded.handle, prompt_text)
+        self.cassette.entries[Cassette.key(model_name, scanner.PROMPT_VERSION, uploaded.digest)] = {
+            "text": text,
+            "latency_s": round(time.monotonic() - started, 3),
+        }
+        return text
+
+
+class ReplayTransport(scanner.GeminiTransport):
+    def __init__(self, cassette: Cassette, simulate_latency: bool = False):
+        self.cassette = cassette
+        self.simulate_latency = simulate_latency
+
+    def upload(self, image_path: str):
+        return _Upload(image_path, memory.file_digest(image_path))
+
+    async def generate(self, model_name: str, uploaded, prompt_text: str) -> str:
+        key = Cassette.key(model_name, scanner.PROMPT_VERSION, uploaded.digest)
+        entry = self.cassette.entries.get(key)
+        if entry is None:
+            raise CassetteMiss(f"No recording for {key}")
+        if self.simulate_latency:
+            await asyncio.sleep(entry["latency_s"])
+        return entry["text"]
+
+
+def _normalize_biomarkers(biomarkers) -> set:
+    pairs = set()
+    for marker in biomarkers or []:
+        name = str(marker.get("name", "")).strip().lower()
+        value = str(marker.get("value", "")).strip().lower()
+        if name:
+            pairs.add((name, value))
+    return pairs
+
+
+def agreement(predicted, reference) -> dict:
+    """Precision/recall/F1 over (name, value) biomarker pairs."""
+    predicted, reference = _normalize_biomarkers(predicted), _normalize_biomarkers(reference)
+    if not predicted and not reference:
+        return {"precision": 1.0, "recall": 1.0, "f1": 1.0}
+    hits = len(predicted & reference)
+    precision = hits / len(predicted) if predicted else 0.0
+    recall = hits / len(reference) if reference else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+async def evaluate_model(files: list, model_name: str, concurrency: int) -> dict:
+    """Runs every file through scan_document_async restricted to `model_name`."""
+    scanner.candidate_models = [model_name]
+    semaphore = asyncio.Semaphore(concurrency)
+    outputs, latencies = {}, []
+
+    async def one(path):
+        async with semaphore:
+            started = time.monotonic()
+            outputs[path] = await scanner.scan_document_async(path, hedging=False)
+            latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(one(path) for path in files))
+    wall = time.monotonic() - started
+
+    ordered = sorted(latencies)
+    return {
+        "outputs": outputs,
+        "parse_success": sum(1 for out in outputs.values() if "error" not in out) / len(files),
+        "throughput_docs_s": round(len(files) / wall, 2) if wall else None,
+        "latency_p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "latency_p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))] * 1000, 2),
+    }
+
+
+async def evaluate_models(files: list, models: list, concurrency: int) -> dict:
+    """
+    Evaluates `models` one after another on a single event loop, so clients and
+    executors set up by the scanner are shared rather than rebuilt per model.
+    """
+    return {model_name: await evaluate_model(files, model_name, concurrency) for model_name in models}
+
+
+def run(mode: str, corpus_dir: str, models: list, concurrency: int = 4, simulate_latency: bool = False) -> dict:
+    files = list(memory.iter_archive(corpus_dir))
+    if not files:
+        raise SystemExit(f"No supported files in {corpus_dir}")
+
+    cassette = Cassette(os.path.join(corpus_dir, "cassette.json"))
+    labels_path = os.path.join(corpus_dir, "labels.json")
+    labels = {}
+    if os.path.exists(labels_path):
+        with open(labels_path, encoding="utf-8") as f:
+            labels = json.load(f)
+
+    original = (scanner.transport, scanner.candidate_models, retry_policy.scan_policy)
+    if mode == "record":
+        scanner.transport = RecordingTransport(cassette)
+    else:
+        scanner.transport = ReplayTransport(cassette, simulate_latency)
+        retry_policy.scan_policy = NO_RETRY
+
+    report = {"mode": mode, "prompt_version": scanner.PROMPT_VERSION, "files": len(files), "models": {}}
+    reference = None
+    try:
+        results = asyncio.run(evaluate_models(files, models, concurrency))
+        for model_name, result in results.items():
+            outputs = result.pop("outputs")
+            if reference is None:
+                reference = outputs
+
+            scores = []
+            for path in files:
+                truth = labels.get(os.path.relpath(path, corpus_dir))
+                expected = truth.get("biomarkers") if truth else reference[path].get("biomarkers")
+                scores.append(agreement(outputs[path].get("biomarkers"), expected)["f1"])
+            result["biomarker_f1"] = round(statistics.mean(scores), 4)
+            result["reference"] = "labels" if labels else models[0]
+            report["models"][model_name] = result
+    finally:
+        scanner.transport, scanner.candidate_models, retry_policy.scan_policy = original
+        if mode == "record":
+            cassette.save()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record/replay scanner evaluation")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("corpus_dir")
+    parser.add_argument("--models", nargs="+", default=list(scanner.candidate_models))
+    parser.add_argument("--prompt-file", help="Evaluate an alternative prompt instead of scanner.prompt")
+    parser.add_argument("--prompt-version", help="Label for the prompt (cassette key); required with --prompt-file")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--simulate-latency", action="store_true", help="Replay recorded model latency")
+    args = parser.parse_args()
+
+    if args.prompt_file:
+        if not args.prompt_version:
+            sys.exit("--prompt-version is required with --prompt-file")
+        with open(args.prompt_file, encoding="utf-8") as f:
+            scanner.prompt = f.read()
+    if args.prompt_version:
+        scanner.PROMPT_VERSION = args.prompt_version
+
+    print(json.dumps(run(args.mode, args.corpus_dir, args.models, args.concurrency, args.simulate_latency), indent=2))
@@ -1,57 +1,138 @@
 import os
 import json
+import asyncio
+import threading
+from collections import deque
 import google.generativeai as genai
 try:
     from app_secrets import GEMINI_API_KEY
 except ImportError:
     GEMINI_API_KEY = None
 import time
-import random
+import retry_policy
+import log_config
+
+logger = log_config.get_logger("scanner")
 
 # Prioritize environment variable (for Render), fallback to local file
 api_key = os.getenv("GEMINI_API_KEY") or GEMINI_API_KEY
 
 if not api_key:
     # Not raising error here to avoid crashing entire app on import, but scan will fail
-    print("WARNING: GEMINI_API_KEY not found in environment or app_secrets.py")
+    logger.warning("GEMINI_API_KEY not found in environment or app_secrets.py")
 
 # Configure Gemini
 if api_key:
     genai.configure(api_key=api_key)
 
-def scan_document(image_path: str):
+# Hedged requests (opt-in): when the current model is slower than the recent
+# latency percentile, fire the same scan at the next candidate model and keep
+# whichever valid result arrives first. Hedges are capped to a fraction of scans.
+SCAN_HEDGING = os.getenv("SCAN_HEDGING", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("SCAN_HEDGE_PERCENTILE", "90"))
+HEDGE_MAX_RATE = float(os.getenv("SCAN_HEDGE_MAX_RATE", "0.2"))
+HEDGE_MIN_DELAY = float(os.getenv("SCAN_HEDGE_MIN_DELAY", "2"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("SCAN_HEDGE_DEFAULT_DELAY", "15"))
+
+
+class LatencyTracker:
+    """Rolling window of successful model call latencies (seconds)."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p: float):
+        """Returns the p-th percentile, or None until enough samples were seen."""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class HedgeBudget:
     """
-    Scans a medical document image and extracts biomarkers using Gemini Vision.
+    Token bucket bounding hedged scans to `max_rate` of all scans.
+    Every scan earns `max_rate` tokens (up to `burst`), every hedge spends one.
     """
-    print(f"Scanning document: {image_path}...")
-    
-    # Check if file exists
-    if not os.path.exists(image_path):
-        return {"error": "File not found"}
 
-    try:
-        # Upload the file to Gemini (or load locally if passing bytes, 
-        # but 1.5/3.0 usually supports file API or inline data)
-        # Using File API for robust handling of large images
-        myfile = genai.upload_file(image_path)
-        
-        # Initialize the model
-        # User requested 'gemini-3-pro-vision'. 
-        # Fallback to 'gemini-1.5-pro' if 3 is not yet available in the SDK environment context.
-        model_name = "gemini-1.5-pro" # Using 1.5 as 3 is hypothetical for this exercise's execution context
-        # However, to satisfy the prompt's strict requirement, I will define it:
-        # model = genai.GenerativeModel("gemini-3-pro-vision")
-        # But for actual working code in a 'prototype' that might be run now, I should use a real model name
-        # OR put a comment. The prompt says "Use Gemini 3... with gemini-3-pro-vision". 
-        # I will use the requested name but add a fallback comment.
-        # Switching to Flash models which typically have higher rate limits
-        candidate_models = [
-            "models/gemini-3-flash-preview", 
-            "models/gemini-2.5-flash",
-            "models/gemini-2.0-flash-exp"
-        ]
-
-        prompt = """
+    def __init__(self, max_rate: float, burst: float = 2.0):
+        self.max_rate = max_rate
+        self.burst = burst
+        self.tokens = 0.0
+        self.scans = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def record_scan(self):
+        with self.lock:
+            self.scans += 1
+            self.tokens = min(self.burst, self.tokens + self.max_rate)
+
+    def try_acquire(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            self.hedges += 1
+            return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "scans": self.scans,
+                "hedges": self.hedges,
+                "hedge_rate": self.hedges / self.scans if self.scans else 0.0,
+            }
+
+
+latency_tracker = LatencyTracker()
+hedge_budget = HedgeBudget(HEDGE_MAX_RATE)
+
+
+def hedge_delay() -> float:
+    """Seconds to wait on a model before hedging to the next candidate."""
+    threshold = latency_tracker.percentile(HEDGE_PERCENTILE)
+    if threshold is None:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, threshold)
+
+
+class GeminiTransport:
+    """
+    The scanner's only contact with the Gemini API.
+    scan_eval swaps `transport` for a recording or replaying one.
+    """
+
+    def upload(self, image_path: str):
+        return genai.upload_file(image_path)
+
+    async def generate(self, model_name: str, uploaded, prompt_text: str) -> str:
+        model = genai.GenerativeModel(model_name)
+        result = await model.generate_content_async([uploaded, prompt_text])
+        return result.text
+
+
+transport = GeminiTransport()
+
+# Bump when `prompt` changes so recorded evaluations stay comparable
+PROMPT_VERSION = "v1"
+
+# Switching to Flash models which typically have higher rate limits
+candidate_models = [
+    "models/gemini-3-flash-preview",
+    "models/gemini-2.5-flash",
+    "models/gemini-2.0-flash-exp"
+]
+
+prompt = """
         Extract all numerical health biomarkers (e.g., HbA1c, Lipid Profile, Vitamin D) from this image.
         Analyze the data to calculate a 'Health Score' (0-100) and identify key correlations.
 
@@ -61,7 +142,7 @@ def scan_document(image_path: str):
                 {"name": "Biomarker Name", "value": "Numeric Value", "unit": "Unit", "status": "Normal/High/Low"}
             ],
             "overall_status": "Healthy or Critical",
-            "health_score": 85, 
+            "health_score": 85,
             "velocity": "Stable, Improving, or Declining",
             "primary_risk": "Main risk factor (e.g. High Cortisol)",
             "hydration_level": "High, Medium, or Low",
@@ -70,64 +151,145 @@ def scan_document(image_path: str):
                 {
                     "title": "Insight Title (e.g. Hydration Alert)",
                     "description": "Explanation of the correlation.",
-                    "type": "positive/negative/neutral" 
+                    "type": "positive/negative/neutral"
                 }
             ]
         }
         """
 
-        last_error = None
-        
-        for model_name in candidate_models:
-            print(f"\n[LIVE START] 🟢 Initializing Vision Engine...")
-            print(f"[LIVE INFO] 🤖 Model Selected: {model_name}")
-            print(f"[LIVE INFO] 📤 Uploading image data to Cloud Context...")
+
+async def _scan_with_model(model_name: str, myfile, deadline: float = None):
+    """
+    Runs the scan prompt against a single model under `retry_policy.scan_policy`.
+    Raises once the policy gives up (e.g. quota) so the caller can move on to the next model.
+    """
+    logger.debug("scan attempt starting", extra={"model": model_name})
+
+    async def attempt():
+        started = time.monotonic()
+        text_response = await transport.generate(model_name, myfile, prompt)
+
+        json_str = text_response.replace("```json", "").replace("```", "").strip()
+        parsed = json.loads(json_str)
+        latency_tracker.record(time.monotonic() - started)
+        return parsed
+
+    # Robust Retry for High-Latency Quotas (observed 28s+ delays)
+    parsed = await retry_policy.scan_policy.call(attempt, deadline=deadline, label=model_name)
+    logger.info("scan succeeded", extra={"model": model_name})
+    return parsed
+
+
+async def _scan_candidates(myfile, hedging: bool, deadline: float = None):
+    """
+    Walks `candidate_models` in order. Without hedging a model is only tried
+    after the previous one has failed. With hedging, a model that runs past
+    `hedge_delay()` is raced against the next one; the first valid result wins
+    and the loser is cancelled.
+    """
+    remaining = list(candidate_models)
+    pending = {}
+    last_error = None
+    retry_after = None
+
+    def launch():
+        model_name = remaining.pop(0)
+        task = asyncio.ensure_future(_scan_with_model(model_name, myfile, deadline))
+        pending[task] = model_name
+
+    while pending or remaining:
+        if not pending:
+            launch()
+
+        timeout = None
+        if hedging and remaining and len(pending) == 1:
+            timeout = hedge_delay()
+
+        done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+        if not done:
+            if hedge_budget.try_acquire():
+                logger.info("hedging slow scan", extra={
+                    "model": next(iter(pending.values())), "hedge_model": remaining[0], "hedge_delay_s": round(timeout, 2)
+                })
+                launch()
+            else:
+                # Budget spent: keep waiting on the current model without hedging
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+        for task in done:
+            model_name = pending.pop(task)
             try:
-                model = genai.GenerativeModel(model_name)
-                
-                # Robust Retry for High-Latency Quotas (observed 28s+ delays)
-                max_retries = 3
-                base_delay = 10
-                
-                for attempt in range(max_retries):
-                    try:
-                        print(f"Scanning... Attempt {attempt + 1}/{max_retries}")
-                        result = model.generate_content([myfile, prompt])
-                        
-                        # Success!
-                        text_response = result.text
-                        json_str = text_response.replace("```json", "").replace("```", "").strip()
-                        print(f"✅ Success with {model_name}")
-                        return json.loads(json_str)
-
-                    except Exception as e:
-                        error_str = str(e)
-                        # Check for quota/rate limit errors
-                        if "429" in error_str or "quota" in error_str.lower() or "ResourceExhausted" in error_str:
-                            print(f"⚠️ Quota exhausted for {model_name}. Trying next model...")
-                            # Don't retry this model, move to next one immediately
-                            raise e
-                        else:
-                            # For other errors, retry with exponential backoff
-                            if attempt < max_retries - 1:
-                                wait_time = base_delay * (1.5 ** attempt) + random.uniform(2, 5)
-                                print(f"Temporary error. Waiting {wait_time:.1f}s...")
-                                time.sleep(wait_time)
-                                continue
-                            else:
-                                raise e
-                
+                result = task.result()
             except Exception as e:
-                print(f"❌ Model {model_name} failed: {type(e).__name__}")
+                logger.warning("scan model failed", extra={"model": model_name, "error": type(e).__name__})
                 last_error = e
+                hint = retry_policy.retry_after_hint(e)
+                if hint is not None:
+                    retry_after = hint if retry_after is None else min(retry_after, hint)
                 # Continue to next model in the list
                 continue
-                
-        return {"error": f"All models exhausted. Last error: {str(last_error)}"}
+
+            for loser in pending:
+                loser.cancel()
+            return result
+
+    result = {"error": f"All models exhausted. Last error: {str(last_error)}"}
+    if retry_after is not None:
+        # Earliest quota reset across models, surfaced so the client can back off
+        result["retry_after"] = retry_after
+    return result
+
+
+async def scan_document_async(image_path: str, hedging: bool = None):
+    """
+    Scans a medical document image and extracts biomarkers using Gemini Vision.
+    Set `hedging` (defaults to SCAN_HEDGING) to race slow models against the next candidate.
+    """
+    logger.debug("scanning document", extra={"path": image_path})
+
+    deadline = retry_policy.scan_policy.deadline()
+
+    # Check if file exists
+    if not os.path.exists(image_path):
+        return {"error": "File not found"}
+
+    if hedging is None:
+        hedging = SCAN_HEDGING
+
+    try:
+        # Using File API for robust handling of large images
+        myfile = await asyncio.to_thread(transport.upload, image_path)
+
+        hedge_budget.record_scan()
+        return await _scan_candidates(myfile, hedging, deadline)
 
     except Exception as e:
         return {"error": str(e)}
 
+
+def scan_document(image_path: str, hedging: bool = None):
+    """
+    Synchronous wrapper around `scan_document_async` for threadpool endpoints and scripts.
+    """
+    return asyncio.run(scan_document_async(image_path, hedging=hedging))
+
+
+def to_health_data(result: dict, user_id: str, last_scan: str = "Just Now") -> dict:
+    """Maps a scan result to the `healthScans` document shape the dashboard reads."""
+    return {
+        "status": result.get("overall_status") or "Neutral",
+        "hydration": result.get("hydration_level") or "Medium",
+        "lastScan": last_scan,
+        "details": result.get("summary") or "Analysis complete.",
+        "score": result.get("health_score") or "--",
+        "velocity": result.get("velocity") or "Unknown",
+        "riskFactor": result.get("primary_risk") or "None",
+        "correlations": result.get("correlations") or [],
+        "user_id": user_id
+    }
+
+
 if __name__ == "__main__":
     # Test run
     report_path = "uploads/blood_test_report.jpg"
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+# Every SingleFlight registers here so /debug/singleflight can report them
+registry = []
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Keyed single-flight: concurrent calls with the same key share one execution
+    and its result (or exception). The key is forgotten as soon as the call
+    finishes, so this coalesces in-flight work only and never caches.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.tasks = {}
+        self.executed = 0
+        self.coalesced = 0
+        registry.append(self)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Blocking variant for threadpool code paths."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """
+        Async variant: `fn` is a coroutine function. Followers await the leader's
+        task through a shield, so a disconnecting caller doesn't cancel the shared work.
+        """
+        loop_key = (id(asyncio.get_running_loop()), key)
+        task = self.tasks.get(loop_key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self.tasks[loop_key] = task
+            task.add_done_callback(lambda _: self.tasks.pop(loop_key, None))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.calls) + len(self.tasks),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
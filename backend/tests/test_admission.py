@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+import admission
+from admission import EndpointLimiter, Overloaded
+
+
+def test_per_user_cap_does_not_block_other_users(monkeypatch):
+    limiter = EndpointLimiter("chat", max_concurrency=1, max_queue=8, max_queue_per_user=1, max_wait=1)
+    monkeypatch.setitem(admission.limiters, "/chat", limiter)
+
+    async def scenario():
+        release = asyncio.Event()
+        served = []
+
+        async def request(user):
+            async with admission.admit("/chat", user):
+                served.append(user)
+                await release.wait()
+
+        first = asyncio.create_task(request("alice"))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(request("alice"))
+        other = asyncio.create_task(request("bob"))
+        await asyncio.sleep(0)
+
+        # alice already has one request waiting; bob still gets a place in the queue
+        with pytest.raises(Overloaded) as shed:
+            await request("alice")
+        assert shed.value.status_code == 429
+        assert limiter.queued == 2
+
+        release.set()
+        await asyncio.gather(first, queued, other)
+        return served
+
+    assert asyncio.run(scenario()) == ["alice", "alice", "bob"]
+    assert limiter.active == 0 and limiter.queued == 0
+
+
+def test_middleware_skips_endpoint_admitted_paths():
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+
+    middleware = admission.AdmissionMiddleware(app)
+    for path in admission.ENDPOINT_ADMITTED:
+        asyncio.run(middleware({"type": "http", "method": "POST", "path": path}, None, None))
+    assert sorted(calls) == sorted(admission.ENDPOINT_ADMITTED)
+    assert all(limiter.admitted == 0 for path, limiter in admission.limiters.items() if path in admission.ENDPOINT_ADMITTED)
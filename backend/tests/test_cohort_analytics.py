@@ -0,0 +1,168 @@
+import os
+import json
+import time
+
+import cohort_analytics
+from cohort_analytics import CohortSketch
+
+
+class FakeRef:
+    def __init__(self, doc_id, parent=None):
+        self.id = doc_id
+        self.parent = parent
+
+
+class FakeDoc:
+    def __init__(self, user_id, doc_id, data):
+        self.id = doc_id
+        # users/{user_id}/healthScans/{doc_id}
+        self.reference = FakeRef(doc_id, FakeRef("healthScans", FakeRef(user_id)))
+        self.data = data
+        self.path = f"users/{user_id}/healthScans/{doc_id}"
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class FakeQuery:
+    """In-memory stand-in for the collection-group query API that iter_pages uses."""
+
+    def __init__(self, docs, fields=None, after=None, count=None):
+        self.docs = docs
+        self.fields = fields
+        self.after = after
+        self.count = count
+
+    def select(self, fields):
+        return FakeQuery(self.docs, list(fields), self.after, self.count)
+
+    def order_by(self, field):
+        assert field == cohort_analytics.DOCUMENT_ID
+        return FakeQuery(sorted(self.docs, key=lambda doc: doc.path), self.fields, self.after, self.count)
+
+    def start_after(self, doc):
+        return FakeQuery(self.docs, self.fields, doc.path, self.count)
+
+    def limit(self, count):
+        return FakeQuery(self.docs, self.fields, self.after, count)
+
+    def stream(self):
+        docs = [doc for doc in self.docs if self.after is None or doc.path > self.after][:self.count]
+        for doc in docs:
+            projected = {key: value for key, value in doc.data.items() if key in self.fields}
+            yield FakeDoc(doc.reference.parent.parent.id, doc.id, projected)
+
+
+class FakeClient:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def collection_group(self, name):
+        assert name == "healthScans"
+        return FakeQuery(self.docs)
+
+
+def make_docs():
+    docs = []
+    for user in range(4):
+        for scan in range(5):
+            score = user * 20 + scan
+            docs.append(FakeDoc(f"user{user}", f"scan{scan}", {
+                "score": score, "riskFactor": "high cortisol" if scan % 2 else "None",
+                "hydration": "Low", "details": "not projected",
+            }))
+    docs.append(FakeDoc("user4", "failed", {"score": "--", "riskFactor": "", "hydration": "Low"}))
+    return docs
+
+
+def test_iter_pages_visits_every_document_once():
+    pages = list(cohort_analytics.iter_pages(FakeClient(make_docs()), page_size=6))
+    assert [len(records) for records, _ in pages] == [6, 6, 6, 3]
+    records = [record for page, _ in pages for record in page]
+    assert len(records) == 21
+    assert all("details" not in record for record in records)
+    assert set().union(*(users for _, users in pages)) == {f"user{i}" for i in range(5)}
+
+
+def test_run_matches_single_pass_aggregate():
+    docs = make_docs()
+    summary = cohort_analytics.run(FakeClient(docs), workers=2, page_size=4)
+
+    expected = CohortSketch()
+    for doc in docs:
+        expected.add(doc.to_dict())
+    assert summary["users"] == 5
+    assert summary["score"] == expected.summary()["score"]
+    assert summary["score"]["unscored"] == 1
+    assert summary["riskFactor"] == expected.summary()["riskFactor"]
+
+
+def test_sketch_merge_is_additive():
+    a, b, both = CohortSketch(), CohortSketch(), CohortSketch()
+    for i, record in enumerate({"score": s, "hydration": "Low"} for s in range(0, 100, 7)):
+        (a if i % 2 else b).add(record)
+        both.add(record)
+    assert a.merge(b).summary() == both.summary()
+
+
+class FakeSnapshot:
+    def __init__(self, data):
+        self.data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class FakeSummaryDB:
+    """Just enough of the client for analytics/cohortSummary reads."""
+
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+
+    def collection(self, name):
+        assert name == "analytics"
+        return self
+
+    def document(self, name):
+        assert name == "cohortSummary"
+        return self
+
+    def get(self):
+        self.reads += 1
+        return FakeSnapshot(self.data)
+
+
+def test_summary_cache_falls_back_to_firestore(tmp_path):
+    path = tmp_path / "cohort_summary.json"
+    db = FakeSummaryDB({"scans": 7})
+    cache = cohort_analytics.SummaryCache(str(path), db=db, max_age_s=60, ttl_s=60)
+
+    # Missing file: Firestore, read once per TTL
+    assert json.loads(cache.get()) == {"scans": 7}
+    assert json.loads(cache.get()) == {"scans": 7}
+    assert db.reads == 1
+
+    # Fresh file wins without touching Firestore
+    cohort_analytics.write_summary({"scans": 9}, path=str(path))
+    assert json.loads(cache.get()) == {"scans": 9}
+    assert db.reads == 1
+
+    # Stale file: back to Firestore once the cached copy expires
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    cache.remote_expires = 0.0
+    db.data = {"scans": 11}
+    assert json.loads(cache.get()) == {"scans": 11}
+    assert db.reads == 2
+
+
+def test_summary_cache_serves_stale_file_when_firestore_is_empty(tmp_path):
+    path = tmp_path / "cohort_summary.json"
+    cohort_analytics.write_summary({"scans": 3}, path=str(path))
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    cache = cohort_analytics.SummaryCache(str(path), db=FakeSummaryDB(None), max_age_s=60)
+    assert json.loads(cache.get()) == {"scans": 3}
+    assert cohort_analytics.SummaryCache(str(tmp_path / "missing.json"), db=FakeSummaryDB(None)).get() is None
@@ -0,0 +1,42 @@
+import datetime
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+import fast_json
+from fast_json import PayloadCache
+
+
+def test_get_or_build_caches_until_invalidated():
+    cache = PayloadCache()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {"n": len(builds)}
+
+    assert cache.get_or_build("user", build) == b'{"n":1}'
+    assert cache.get_or_build("user", build) == b'{"n":1}'
+    cache.invalidate("user")
+    assert cache.get_or_build("user", build) == b'{"n":2}'
+
+
+def test_build_overlapping_invalidate_is_not_stored():
+    cache = PayloadCache()
+
+    def stale_build():
+        # The write lands (and invalidates) while this read is still in progress
+        cache.invalidate("user")
+        return {"state": "before scan"}
+
+    assert cache.get_or_build("user", stale_build) == b'{"state":"before scan"}'
+    assert cache.get_or_build("user", lambda: {"state": "after scan"}) == b'{"state":"after scan"}'
+
+
+def test_dumps_handles_firestore_style_datetimes():
+    class DatetimeWithNanoseconds(datetime.datetime):
+        pass
+
+    value = DatetimeWithNanoseconds(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+    assert fast_json.dumps({"timestamp": value}) == b'{"timestamp":"2026-01-02T03:04:05+00:00"}'
@@ -0,0 +1,151 @@
+import random
+import datetime
+
+from free_busy import FreeBusyIndex, FreeBusyCache
+
+UTC = datetime.timezone.utc
+DAY = datetime.datetime(2026, 10, 19, tzinfo=UTC)
+QUARTER = datetime.timedelta(minutes=15)
+
+
+def at(hour, minute=0, tz=UTC):
+    return datetime.datetime(2026, 10, 19, hour, minute, tzinfo=tz)
+
+
+def minutes(n):
+    return datetime.timedelta(minutes=n)
+
+
+def intervals(index):
+    return list(zip(index.starts, index.ends))
+
+
+def test_overlapping_and_touching_intervals_are_merged():
+    index = FreeBusyIndex(DAY, DAY + datetime.timedelta(days=1), [
+        (at(9), at(10)), (at(9, 30), at(11)), (at(11), at(11, 30)), (at(13), at(14)),
+    ])
+    assert intervals(index) == [(at(9), at(11, 30)), (at(13), at(14))]
+
+    index.add(at(11, 15), at(13, 5))
+    assert intervals(index) == [(at(9), at(14))]
+    index.add(at(15), at(16))
+    assert intervals(index) == [(at(9), at(14)), (at(15), at(16))]
+
+
+def test_is_free():
+    index = FreeBusyIndex(DAY, DAY + datetime.timedelta(days=1), [(at(9), at(10)), (at(12), at(13))])
+    assert index.is_free(at(10), at(12))
+    assert not index.is_free(at(9, 59), at(10, 30))
+    assert not index.is_free(at(11), at(12, 1))
+    assert not index.is_free(at(8), at(14))
+
+
+def test_next_free_uses_clock_quarter_hours():
+    index = FreeBusyIndex(DAY, DAY + datetime.timedelta(days=1), [(at(10), at(11)), (at(11, 20), at(14))])
+    # 10:07 is taken; the next hour that fits starts at the 14:00 boundary, not 14:07
+    assert index.next_free(at(10, 7), minutes(60), QUARTER) == at(14)
+    assert index.next_free(at(14, 1), minutes(30), QUARTER) == at(14, 15)
+    assert index.next_free(at(23, 30), minutes(60), QUARTER) is None
+
+
+def test_next_free_aligns_in_the_requested_time_zone():
+    # A +00:20 zone makes local quarter hours differ from UTC ones
+    tz = datetime.timezone(minutes(20))
+    index = FreeBusyIndex(DAY, DAY + datetime.timedelta(days=1), [(at(10), at(10, 50))])
+    slot = index.next_free(at(10, 7).astimezone(tz), minutes(30), QUARTER)
+    assert slot.astimezone(tz).minute % 15 == 0
+    assert slot == at(10, 55)
+
+
+def test_index_matches_brute_force():
+    rng = random.Random(42)
+    window_end = DAY + datetime.timedelta(days=1)
+    for _ in range(200):
+        busy = []
+        for _ in range(rng.randint(0, 15)):
+            start = DAY + minutes(rng.randint(0, 1400))
+            busy.append((start, start + minutes(rng.randint(1, 90))))
+        index = FreeBusyIndex(DAY, window_end, busy)
+        for _ in range(rng.randint(0, 3)):
+            start = DAY + minutes(rng.randint(0, 1400))
+            end = start + minutes(rng.randint(1, 60))
+            index.add(start, end)
+            busy.append((start, end))
+
+        def free(start, end):
+            return all(end <= busy_start or busy_end <= start for busy_start, busy_end in busy)
+
+        for _ in range(20):
+            start = DAY + minutes(rng.randint(0, 1400))
+            duration = minutes(rng.randint(5, 120))
+            assert index.is_free(start, start + duration) == free(start, start + duration)
+
+            expected = start + (-(start - DAY) % QUARTER)
+            while expected + duration <= window_end and not free(expected, expected + duration):
+                expected += QUARTER
+            if expected + duration > window_end:
+                expected = None
+            assert index.next_free(start, duration, QUARTER) == expected
+
+
+class FakeCalendarAPI:
+    def __init__(self, busy):
+        self.busy = busy
+        self.queries = []
+
+    def freebusy(self):
+        return self
+
+    def query(self, body):
+        self.queries.append(body)
+        return self
+
+    def execute(self):
+        return {"calendars": {"primary": {"busy": self.busy}}}
+
+
+def test_cache_queries_once_per_window_and_records_inserts():
+    api = FakeCalendarAPI([{"start": "2026-10-19T09:00:00Z", "end": "2026-10-19T10:00:00Z"}])
+    cache = FreeBusyCache(ttl_s=60, window_days=7)
+
+    index = cache.get("user", api, at(8), at(9))
+    assert cache.get("user", api, at(15), at(16)) is index
+    assert len(api.queries) == 1
+    assert not index.is_free(at(9, 30), at(9, 45))
+
+    cache.record_busy("user", at(15), at(16))
+    assert not cache.get("user", api, at(15), at(16)).is_free(at(15, 30), at(15, 45))
+    assert len(api.queries) == 1
+
+    cache.invalidate("user")
+    cache.get("user", api, at(8), at(9))
+    assert len(api.queries) == 2
+
+
+def test_user_lock_is_shared_per_user():
+    cache = FreeBusyCache()
+    assert cache.user_lock("alice") is cache.user_lock("alice")
+    assert cache.user_lock("alice") is not cache.user_lock("bob")
+
+
+def test_next_free_respects_max_shift():
+    index = FreeBusyIndex(DAY, DAY + datetime.timedelta(days=1), [(at(18), at(20))])
+    assert index.next_free(at(18), minutes(60), QUARTER, max_shift=datetime.timedelta(hours=2)) == at(20)
+    assert index.next_free(at(18), minutes(60), QUARTER, max_shift=datetime.timedelta(hours=1)) is None
+
+
+def test_next_free_stays_inside_day_window():
+    day = (datetime.time(8), datetime.time(21))
+    index = FreeBusyIndex(DAY, DAY + datetime.timedelta(days=3), [(at(18), at(20, 30))])
+    # The hour after 20:30 would end past 21:00, so the next candidate is 08:00 tomorrow
+    assert index.next_free(at(18), minutes(60), QUARTER, day_window=day) == at(8) + datetime.timedelta(days=1)
+    assert index.next_free(at(18), minutes(60), QUARTER, max_shift=datetime.timedelta(hours=6), day_window=day) is None
+    assert index.next_free(at(5), minutes(30), QUARTER, day_window=day) == at(8)
+
+
+def test_day_window_uses_the_requested_time_zone():
+    tz = datetime.timezone(datetime.timedelta(hours=-5))
+    day = (datetime.time(8), datetime.time(21))
+    index = FreeBusyIndex(DAY, DAY + datetime.timedelta(days=2), [])
+    # 10:00 UTC is 05:00 at UTC-5, before the window opens at 08:00 local (13:00 UTC)
+    assert index.next_free(at(10).astimezone(tz), minutes(30), QUARTER, day_window=day) == at(13)
@@ -0,0 +1,97 @@
+import datetime
+
+import pytest
+
+import health_history
+
+
+class FakeDoc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class FakeQuery:
+    """In-memory stand-in for the healthScans query chain fetch_page builds."""
+
+    def __init__(self, docs, orders=(), fields=None, after=None, count=None):
+        self.docs = docs
+        self.orders = orders
+        self.fields = fields
+        self.after = after
+        self.count = count
+
+    def _with(self, **changes):
+        state = dict(docs=self.docs, orders=self.orders, fields=self.fields, after=self.after, count=self.count)
+        state.update(changes)
+        return FakeQuery(**state)
+
+    def order_by(self, field, direction):
+        assert direction == "DESCENDING"
+        return self._with(orders=self.orders + (field,))
+
+    def select(self, fields):
+        return self._with(fields=list(fields))
+
+    def start_after(self, values):
+        assert set(values) == set(self.orders)
+        return self._with(after=values)
+
+    def limit(self, count):
+        return self._with(count=count)
+
+    def stream(self):
+        assert self.orders == ("timestamp", health_history.DOCUMENT_ID)
+        key = lambda doc: (doc.data["timestamp"], doc.id)
+        docs = sorted(self.docs, key=key, reverse=True)
+        if self.after is not None:
+            anchor = (self.after["timestamp"], self.after[health_history.DOCUMENT_ID])
+            docs = [doc for doc in docs if key(doc) < anchor]
+        for doc in docs[:self.count]:
+            yield FakeDoc(doc.id, {k: v for k, v in doc.data.items() if k in self.fields})
+
+
+class FakeDB:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def collection(self, name):
+        return self
+
+    def document(self, name):
+        return self
+
+    # Path lookups land on the healthScans query; there is no document get(), so a cursor must not need one
+    def __getattr__(self, name):
+        return getattr(FakeQuery(self.docs), name)
+
+
+def make_docs():
+    base = datetime.datetime(2026, 3, 1, 12, 0)
+    # Pairs share a timestamp so the id tie-breaker matters
+    return [FakeDoc(f"scan{i}", {"timestamp": base + datetime.timedelta(hours=i // 2), "score": i, "details": "x"})
+            for i in range(7)]
+
+
+def test_pages_walk_every_scan_once_newest_first():
+    db = FakeDB(make_docs())
+    first = health_history.fetch_page(db, "u1", limit=3)
+    assert [item["id"] for item in first["items"]] == ["scan6", "scan5", "scan4"]
+    assert all("details" not in item for item in first["items"])
+
+    second = health_history.fetch_page(db, "u1", limit=3, cursor=first["next_cursor"])
+    assert [item["id"] for item in second["items"]] == ["scan3", "scan2", "scan1"]
+
+    last = health_history.fetch_page(db, "u1", limit=3, cursor=second["next_cursor"])
+    assert [item["id"] for item in last["items"]] == ["scan0"]
+    assert last["next_cursor"] is None
+
+
+def test_cursor_round_trips_and_rejects_garbage():
+    when = datetime.datetime(2026, 3, 1, 12, 0, tzinfo=datetime.timezone.utc)
+    assert health_history.decode_cursor(health_history.encode_cursor(when, "scan1")) == (when, "scan1")
+    with pytest.raises(health_history.InvalidQuery):
+        health_history.decode_cursor("not-a-cursor")
@@ -0,0 +1,49 @@
+import pytest
+
+import intent_classifier
+from intent_classifier import IntentClassifier
+
+
+@pytest.mark.parametrize("text", [
+    "I was in a car accident and my neck hurts",
+    "My knee hurts when I play football",
+    "I got a bug bite, it itches",
+    "how is the weather",
+    "fix my python code bug",
+    # Travel, screen time and sport all come up in real health questions
+    "Which vaccines do I need before my flight to travel to India?",
+    "Should I get a covid booster before my flight and hotel stay?",
+    "Is sitting at my laptop coding all day bad for my posture?",
+    "Can I drink alcohol while watching football games?",
+])
+def test_health_or_unclear_messages_reach_the_model(text):
+    intent = IntentClassifier().classify(text)
+    assert intent.label in (intent_classifier.SIMPLE, intent_classifier.COMPLEX)
+    assert intent.local_reply is None
+
+
+@pytest.mark.parametrize("text", [
+    "who won the football match",
+    "what is the capital of france",
+    "tell me a joke",
+    "write a poem about the sea",
+])
+def test_clearly_off_topic_messages_are_refused_locally(text):
+    intent = IntentClassifier().classify(text)
+    assert intent.label == intent_classifier.OFF_TOPIC
+    assert intent.local_reply == intent_classifier.REFUSAL
+
+
+def test_greetings_are_answered_locally():
+    intent = IntentClassifier().classify("hi there bio-twin!")
+    assert intent.label == intent_classifier.GREETING
+    assert intent.local_reply
+
+
+def test_stats_count_classified_messages():
+    classifier = IntentClassifier()
+    classifier.classify("hello")
+    classifier.classify("my knee hurts")
+    stats = classifier.stats()
+    assert stats["total"] == 2
+    assert stats["call_avoidance_rate"] == 0.5
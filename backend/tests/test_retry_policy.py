@@ -0,0 +1,159 @@
+import json
+import time
+import asyncio
+
+import pytest
+
+import retry_policy
+from retry_policy import ErrorPolicy, RetryPolicy, QUOTA, TRANSIENT, FATAL
+
+
+# Stand-ins named like the google-api-core / httpx exceptions the SDKs raise
+class GoogleAPICallError(Exception):
+    code = None
+
+
+class ResourceExhausted(GoogleAPICallError):
+    code = 429
+
+
+class ServiceUnavailable(GoogleAPICallError):
+    code = 503
+
+
+class DeadlineExceeded(GoogleAPICallError):
+    code = 504
+
+
+class InvalidArgument(GoogleAPICallError):
+    code = 400
+
+
+class ConnectError(Exception):
+    pass
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, message, response):
+        super().__init__(message)
+        self.response = response
+
+
+@pytest.mark.parametrize("error, expected", [
+    (ResourceExhausted("Quota exceeded for metric"), QUOTA),
+    (ServiceUnavailable("The model is overloaded"), TRANSIENT),
+    (DeadlineExceeded("Request took too long"), TRANSIENT),
+    (InvalidArgument("Request contains an invalid argument"), FATAL),
+    (HTTPStatusError("Too many", FakeResponse(429)), QUOTA),
+    (HTTPStatusError("Bad gateway", FakeResponse(502)), TRANSIENT),
+    (ConnectError("name resolution failed"), TRANSIENT),
+    (TimeoutError(), TRANSIENT),
+    (ConnectionResetError(), TRANSIENT),
+    (json.JSONDecodeError("Expecting value", "", 0), TRANSIENT),
+    # Wording alone no longer decides the class
+    (ValueError("Invalid value 500 for field score"), FATAL),
+    (ValueError("connection string is malformed"), FATAL),
+    (InvalidArgument("timeout must be positive"), FATAL),
+])
+def test_classify_error_uses_status_and_type(error, expected):
+    assert retry_policy.classify_error(error) == expected
+
+
+def test_retry_after_hint():
+    assert retry_policy.retry_after_hint(HTTPStatusError("slow down", FakeResponse(429, {"Retry-After": "7"}))) == 7.0
+    assert retry_policy.retry_after_hint(ResourceExhausted("Please retry in 37.8s.")) == 37.8
+    assert retry_policy.retry_after_hint(ResourceExhausted("retry_delay {\n  seconds: 12\n}")) == 12.0
+    assert retry_policy.retry_after_hint(ServiceUnavailable("overloaded")) is None
+
+
+def test_error_policy_backoff():
+    policy = ErrorPolicy(max_attempts=4, base_delay=1, multiplier=2, max_delay=3, jitter=(0, 0))
+    assert [policy.delay(attempt, None) for attempt in range(4)] == [1, 2, 3, None]
+
+
+def test_error_policy_hints():
+    policy = ErrorPolicy(max_attempts=3, max_hint_wait=5, require_hint=True)
+    assert policy.delay(0, 2.5) == 2.5
+    assert policy.delay(0, 30) is None  # reset too far away: give up now
+    assert policy.delay(0, None) is None
+
+
+def fast_policy(**overrides):
+    policies = {
+        QUOTA: ErrorPolicy(max_attempts=1),
+        TRANSIENT: ErrorPolicy(max_attempts=3, base_delay=0.01, jitter=(0, 0)),
+        FATAL: ErrorPolicy(max_attempts=1),
+    }
+    policies.update(overrides)
+    return RetryPolicy(policies)
+
+
+def flaky(errors, result="ok"):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return fn, calls
+
+
+def test_transient_errors_are_retried():
+    fn, calls = flaky([ServiceUnavailable("busy"), ConnectError("reset")])
+    assert asyncio.run(fast_policy().call(fn)) == "ok"
+    assert len(calls) == 3
+
+
+def test_fatal_errors_are_not_retried():
+    fn, calls = flaky([InvalidArgument("bad")])
+    with pytest.raises(InvalidArgument):
+        asyncio.run(fast_policy().call(fn))
+    assert len(calls) == 1
+
+
+def test_gives_up_when_wait_would_pass_deadline():
+    policy = fast_policy(**{TRANSIENT: ErrorPolicy(max_attempts=5, base_delay=10, jitter=(0, 0))})
+    fn, calls = flaky([ServiceUnavailable("busy")])
+
+    async def scenario():
+        started = time.monotonic()
+        with pytest.raises(ServiceUnavailable):
+            await policy.call(fn, deadline=policy.deadline(1.0))
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 0.5
+    assert len(calls) == 1
+
+
+def test_deadline_bounds_a_slow_attempt():
+    async def slow():
+        await asyncio.sleep(5)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(fast_policy(**{TRANSIENT: ErrorPolicy(max_attempts=1)}).call(slow, deadline=time.monotonic() + 0.05))
+
+
+def test_abandoned_non_idempotent_call_is_not_retried():
+    calls = []
+
+    def send():
+        calls.append(1)
+        time.sleep(0.2)
+
+    with pytest.raises(retry_policy.AttemptAbandoned):
+        asyncio.run(fast_policy().call(send, deadline=time.monotonic() + 0.05, idempotent=False))
+    assert len(calls) == 1
+
+
+def test_non_idempotent_call_still_retries_errors_it_raised():
+    fn, calls = flaky([TimeoutError("read timed out")])
+    assert asyncio.run(fast_policy().call(fn, idempotent=False)) == "ok"
+    assert len(calls) == 2
@@ -0,0 +1,125 @@
+import time
+import datetime
+
+from token_refresher import TokenRefresher, is_permanent_refresh_error
+
+
+class FakeCreds:
+    refresh_token = "refresh"
+
+    def __init__(self, lifetime_s: float):
+        now_utc = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        self.expiry = now_utc + datetime.timedelta(seconds=lifetime_s)
+        self.valid = True
+
+
+def wait_for(condition, timeout_s: float = 5.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_refreshes_before_expiry():
+    refresher = TokenRefresher(lambda user_id, creds: FakeCreds(3600), margin_s=0.9)
+    refresher.track("user", FakeCreds(1.0))
+    refresher.start()
+    try:
+        assert wait_for(lambda: refresher.stats()["refreshed"] == 1)
+        assert refresher.get("user").expiry > FakeCreds(3000).expiry
+    finally:
+        refresher.stop()
+
+
+def test_background_refreshes_do_not_keep_idle_users_tracked():
+    calls = []
+
+    def refresh(user_id, creds):
+        calls.append(user_id)
+        return FakeCreds(0.3)
+
+    refresher = TokenRefresher(refresh, margin_s=0.2, idle_ttl_s=0.5)
+    refresher.track("user", FakeCreds(0.3))
+    refresher.start()
+    try:
+        assert wait_for(lambda: refresher.stats()["tracked_users"] == 0)
+        refreshed = len(calls)
+        time.sleep(0.5)
+        assert len(calls) == refreshed
+    finally:
+        refresher.stop()
+
+
+def test_get_counts_as_activity():
+    refresher = TokenRefresher(lambda user_id, creds: FakeCreds(0.3), margin_s=0.2, idle_ttl_s=0.5)
+    refresher.track("user", FakeCreds(0.3))
+    refresher.start()
+    try:
+        for _ in range(10):
+            refresher.get("user")
+            time.sleep(0.1)
+        assert refresher.stats()["tracked_users"] == 1
+    finally:
+        refresher.stop()
+
+
+class RefreshError(Exception):
+    """Stand-in for google.auth.exceptions.RefreshError (matched by name)."""
+
+    def __init__(self, *args, retryable=None):
+        super().__init__(*args)
+        if retryable is not None:
+            self.retryable = retryable
+
+
+def test_permanent_refresh_errors():
+    assert is_permanent_refresh_error(RefreshError("invalid_grant: Token has been expired or revoked.",
+                                                   {"error": "invalid_grant"}))
+    assert is_permanent_refresh_error(RefreshError("bad grant", retryable=False))
+    assert is_permanent_refresh_error(RefreshError("invalid_grant: Bad Request"))
+    assert not is_permanent_refresh_error(RefreshError("server_error", {"error": "server_error"}, retryable=True))
+    assert not is_permanent_refresh_error(ConnectionError("invalid_grant"))
+
+
+def test_revoked_grant_stops_retries():
+    calls, revoked = [], []
+
+    def refresh(user_id, creds):
+        calls.append(user_id)
+        raise RefreshError("invalid_grant: Token has been expired or revoked.", {"error": "invalid_grant"})
+
+    refresher = TokenRefresher(refresh, margin_s=1.0, retry_s=0.05,
+                               on_revoked=lambda user_id, error: revoked.append(user_id))
+    refresher.track("user", FakeCreds(0.5))
+    refresher.start()
+    try:
+        assert wait_for(lambda: revoked == ["user"])
+        time.sleep(0.3)
+        assert calls == ["user"]
+        stats = refresher.stats()
+        assert stats["tracked_users"] == 0
+        assert stats["revoked"] == 1
+        assert stats["failed"] == 0
+    finally:
+        refresher.stop()
+
+
+def test_transient_failures_are_retried():
+    calls = []
+
+    def refresh(user_id, creds):
+        calls.append(user_id)
+        if len(calls) < 3:
+            raise ConnectionError("token endpoint unreachable")
+        return FakeCreds(3600)
+
+    refresher = TokenRefresher(refresh, margin_s=1.0, retry_s=0.05)
+    refresher.track("user", FakeCreds(0.5))
+    refresher.start()
+    try:
+        assert wait_for(lambda: refresher.stats()["refreshed"] == 1)
+        assert refresher.stats()["failed"] == 2
+    finally:
+        refresher.stop()
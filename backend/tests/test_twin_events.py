@@ -0,0 +1,64 @@
+import json
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from twin_events import TwinEventHub
+
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(json.loads(queue.get_nowait()))
+    return events
+
+
+def test_publish_fans_out_to_every_connection_of_the_user():
+    async def scenario():
+        hub = TwinEventHub()
+        hub.bind(asyncio.get_running_loop())
+        first, second = hub.subscribe("u1"), hub.subscribe("u1")
+        other = hub.subscribe("u2")
+        hub.publish("u1", "health_state", {"score": 80})
+        hub.publish("nobody", "health_state", {"score": 1})
+        return hub, drain(first), drain(second), drain(other)
+
+    hub, first, second, other = asyncio.run(scenario())
+    assert first == second == [{"type": "health_state", "data": {"score": 80}}]
+    assert other == []
+    assert hub.stats()["published"] == 1
+    assert hub.stats()["delivered"] == 2
+
+
+def test_full_queue_drops_oldest_events():
+    async def scenario():
+        hub = TwinEventHub(queue_size=2)
+        hub.bind(asyncio.get_running_loop())
+        queue = hub.subscribe("u1")
+        for n in range(4):
+            hub.publish("u1", "scan_progress", {"n": n})
+        return hub, drain(queue)
+
+    hub, events = asyncio.run(scenario())
+    assert [event["data"]["n"] for event in events] == [2, 3]
+    assert hub.stats()["dropped"] == 2
+
+
+def test_publish_from_another_thread():
+    async def scenario():
+        hub = TwinEventHub()
+        hub.bind(asyncio.get_running_loop())
+        queue = hub.subscribe("u1")
+        publisher = threading.Thread(target=hub.publish, args=("u1", "health_state", {"score": 70}))
+        publisher.start()
+        payload = await asyncio.wait_for(queue.get(), timeout=5)
+        publisher.join()
+        hub.unsubscribe("u1", queue)
+        return hub, json.loads(payload)
+
+    hub, event = asyncio.run(scenario())
+    assert event == {"type": "health_state", "data": {"score": 70}}
+    assert hub.stats()["connections"] == 0
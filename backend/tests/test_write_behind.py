@@ -0,0 +1,202 @@
+import json
+import time
+import datetime
+import threading
+
+from write_behind import WriteBehindQueue
+
+
+class FakeRef:
+    def __init__(self, path=()):
+        self.path = path
+
+    def collection(self, name):
+        return FakeRef(self.path + (name,))
+
+    def document(self, name):
+        return FakeRef(self.path + (name,))
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.sets = []
+
+    def set(self, ref, data):
+        self.sets.append(("/".join(ref.path), data))
+
+    def commit(self):
+        if self.db.fail:
+            raise ConnectionError("firestore unavailable")
+        for path, _ in self.sets:
+            if path in self.db.reject:
+                raise self.db.reject[path]
+        self.db.gate.wait()
+        self.db.docs.update(self.sets)
+
+
+class FakeDB(FakeRef):
+    def __init__(self, fail=False):
+        super().__init__()
+        self.fail = fail
+        self.docs = {}
+        self.reject = {}  # doc path -> error raised by any batch containing it
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def spool_events(path):
+    with open(path, encoding="utf-8") as spool:
+        return [json.loads(line) for line in spool if line.strip()]
+
+
+def wait_for(condition, timeout_s=5.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_unflushed_jobs_are_replayed_after_restart(tmp_path):
+    spool = tmp_path / "writes.spool"
+    queue = WriteBehindQueue(FakeDB(fail=True), str(spool))
+    when = datetime.datetime(2026, 1, 2, 3, 4, 5)
+    queue.enqueue(("users", "u1", "healthScans"), {"score": 70, "timestamp": when}, doc_id="a")
+    queue.enqueue(("users", "u1", "healthScans"), {"score": 71}, doc_id="b")
+    queue.stop()  # simulated crash: nothing was flushed
+
+    db = FakeDB()
+    restarted = WriteBehindQueue(db, str(spool), flush_interval_s=0.05)
+    restarted.start()
+    try:
+        assert wait_for(lambda: len(db.docs) == 2)
+    finally:
+        restarted.stop()
+    assert db.docs["users/u1/healthScans/a"] == {"score": 70, "timestamp": when}
+    assert db.docs["users/u1/healthScans/b"] == {"score": 71}
+
+
+def test_acked_jobs_are_not_replayed(tmp_path):
+    spool = tmp_path / "writes.spool"
+    queue = WriteBehindQueue(FakeDB(), str(spool))
+    for doc_id in "abc":
+        queue.enqueue(("users", "u1", "healthScans"), {"id": doc_id}, doc_id=doc_id)
+    assert queue._flush(queue.pending[:2])
+    assert spool_events(spool)[-1] == {"op": "ack", "ids": ["a", "b"]}
+    queue.stop()
+
+    recovered = WriteBehindQueue(FakeDB(), str(spool))
+    recovered._recover()
+    assert [job["id"] for job in recovered.pending] == ["c"]
+    # Recovery compacts the spool to the surviving jobs
+    assert [event["job"]["id"] for event in spool_events(spool)] == ["c"]
+
+
+def test_spool_is_truncated_when_fully_drained(tmp_path):
+    spool = tmp_path / "writes.spool"
+    queue = WriteBehindQueue(FakeDB(), str(spool))
+    queue.enqueue(("users", "u1", "healthScans"), {"n": 1}, doc_id="a")
+    assert queue._flush(list(queue.pending))
+    assert queue.pending == []
+    assert spool_events(spool) == []
+    queue.stop()
+
+
+def test_torn_last_line_is_ignored_on_recovery(tmp_path):
+    spool = tmp_path / "writes.spool"
+    job = {"id": "a", "path": ["users", "u1", "healthScans"], "data": {"n": 1}, "enqueued_at": 0}
+    spool.write_text(json.dumps({"op": "put", "job": job}) + "\n" + '{"op": "put", "job": {"id"', encoding="utf-8")
+    queue = WriteBehindQueue(FakeDB(), str(spool))
+    queue._recover()
+    assert [job["id"] for job in queue.pending] == ["a"]
+    queue.stop()
+
+
+def test_backlog_is_capped(tmp_path):
+    queue = WriteBehindQueue(FakeDB(fail=True), str(tmp_path / "writes.spool"), max_backlog=2)
+    assert queue.enqueue(("users", "u1", "healthScans"), {"n": 1}) is not None
+    assert queue.enqueue(("users", "u1", "healthScans"), {"n": 2}) is not None
+    assert queue.enqueue(("users", "u1", "healthScans"), {"n": 3}) is None
+    assert queue.stats()["backlog"] == 2
+    assert queue.stats()["dropped"] == 1
+    queue.stop()
+
+
+def test_spool_errors_do_not_reach_the_caller(tmp_path):
+    db = FakeDB()
+    queue = WriteBehindQueue(db, str(tmp_path / "missing-dir" / "writes.spool"), flush_interval_s=0.05)
+    assert queue.enqueue(("users", "u1", "healthScans"), {"n": 1}, doc_id="a") == "a"
+    assert queue.stats()["spool_errors"] == 1
+    assert queue._flush(list(queue.pending))
+    assert db.docs == {"users/u1/healthScans/a": {"n": 1}}
+
+
+def test_stop_timeout_leaves_spool_open_for_running_flush(tmp_path):
+    db = FakeDB()
+    db.gate.clear()  # the flusher blocks inside commit
+    queue = WriteBehindQueue(db, str(tmp_path / "writes.spool"), batch_size=1)
+    queue.start()
+    queue.enqueue(("users", "u1", "healthScans"), {"n": 1}, doc_id="a")
+    assert wait_for(lambda: queue.thread.is_alive() and queue.pending)
+    time.sleep(0.05)
+
+    queue.stop(timeout=0.1)
+    assert queue.spool is not None
+    db.gate.set()
+    queue.thread.join(timeout=5)
+    assert db.docs == {"users/u1/healthScans/a": {"n": 1}}
+    assert queue.stats()["last_error"] is None
+
+
+class InvalidArgument(Exception):
+    code = 400
+
+
+def test_rejected_job_is_dead_lettered_and_does_not_block_the_batch(tmp_path):
+    spool = tmp_path / "writes.spool"
+    db = FakeDB()
+    db.reject["users/u1/healthScans/b"] = InvalidArgument("document too large")
+    flushed = []
+    queue = WriteBehindQueue(db, str(spool), on_flushed=flushed.extend)
+    for doc_id in "abc":
+        queue.enqueue(("users", "u1", "healthScans"), {"id": doc_id}, doc_id=doc_id)
+
+    assert queue._flush(list(queue.pending))
+    assert sorted(db.docs) == ["users/u1/healthScans/a", "users/u1/healthScans/c"]
+    assert [job["id"] for job in flushed] == ["a", "c"]
+    assert queue.pending == []
+    dead = spool_events(f"{spool}.dead")
+    assert [entry["job"]["id"] for entry in dead] == ["b"]
+    assert dead[0]["attempts"] == 1
+    assert queue.stats()["dead_lettered"] == 1
+    queue.stop()
+
+
+def test_transient_failures_dead_letter_after_max_attempts(tmp_path):
+    spool = tmp_path / "writes.spool"
+    db = FakeDB()
+    db.reject["users/u1/healthScans/a"] = ConnectionError("reset by peer")
+    queue = WriteBehindQueue(db, str(spool), max_attempts=3)
+    queue.enqueue(("users", "u1", "healthScans"), {"n": 1}, doc_id="a")
+    queue.enqueue(("users", "u1", "healthScans"), {"n": 2}, doc_id="b")
+
+    # Retryable: the head job is tried alone and the flusher backs off
+    assert not queue._flush(list(queue.pending))
+    assert not queue._flush(list(queue.pending))
+    assert [job["id"] for job in queue.pending] == ["a", "b"]
+
+    assert queue._flush(list(queue.pending))
+    assert db.docs == {"users/u1/healthScans/b": {"n": 2}}
+    assert [entry["attempts"] for entry in spool_events(f"{spool}.dead")] == [3]
+    queue.stop()
+
+    # Dead-lettered jobs are acknowledged, so a restart doesn't replay them
+    restarted = WriteBehindQueue(FakeDB(), str(spool))
+    restarted._recover()
+    assert restarted.pending == []
+    restarted.stop()
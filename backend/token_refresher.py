@@ -0,0 +1,181 @@
+import time
+import heapq
+import datetime
+import threading
+
+import log_config
+
+logger = log_config.get_logger("token_refresher")
+
+# OAuth error codes that mean the refresh token itself is no longer usable
+_PERMANENT_OAUTH_ERRORS = {"invalid_grant", "invalid_client", "unauthorized_client"}
+
+
+def is_permanent_refresh_error(error: Exception) -> bool:
+    """
+    True for a google-auth RefreshError that retrying can't fix (revoked or expired
+    grant): `retryable` is False, or the token endpoint's error code says so.
+    """
+    if "RefreshError" not in {cls.__name__ for cls in type(error).__mro__}:
+        return False
+    if getattr(error, "retryable", None) is False:
+        return True
+    for arg in error.args:
+        if isinstance(arg, dict) and arg.get("error") in _PERMANENT_OAUTH_ERRORS:
+            return True
+    # Older google-auth only puts the code in the message: "invalid_grant: Token has been expired or revoked."
+    return str(error).split(":", 1)[0].strip() in _PERMANENT_OAUTH_ERRORS
+
+
+class TokenRefresher:
+    """
+    Background scheduler that refreshes OAuth credentials shortly before they expire.
+
+    Users are tracked while active (`track` from a request-path load or refresh, or a
+    `get`, counts as activity; the background refresh itself does not) and dropped after
+    `idle_ttl_s` without use. `refresh_fn(user_id, creds)` performs the refresh +
+    persistence and returns the refreshed credentials; it must not call `track`.
+    Failures are retried after `retry_s`, except permanent ones (`is_permanent`),
+    which drop the user and call `on_revoked(user_id, error)` so stored
+    credentials can be discarded.
+    """
+
+    def __init__(self, refresh_fn, margin_s: float = 300, idle_ttl_s: float = 24 * 3600, retry_s: float = 60,
+                 on_revoked=None, is_permanent=is_permanent_refresh_error):
+        self.refresh_fn = refresh_fn
+        self.on_revoked = on_revoked
+        self.is_permanent = is_permanent
+        self.margin_s = margin_s
+        self.idle_ttl_s = idle_ttl_s
+        self.retry_s = retry_s
+        self.cond = threading.Condition()
+        self.heap = []       # (due wall time, user_id)
+        self.due = {}        # user_id -> currently scheduled due time
+        self.entries = {}    # user_id -> [creds, last_seen]
+        self.thread = None
+        self.stopping = False
+        self.refreshed = 0
+        self.failed = 0
+        self.revoked = 0
+
+    def track(self, user_id: str, creds):
+        """Registers (or updates) a user's credentials and schedules the next refresh."""
+        if not creds or not creds.refresh_token:
+            return
+        with self.cond:
+            self.entries[user_id] = [creds, time.time()]
+            self._schedule(user_id, self._due_for(creds))
+            self.cond.notify()
+
+    def forget(self, user_id: str):
+        """Stops tracking `user_id`; any scheduled refresh is skipped."""
+        with self.cond:
+            self.entries.pop(user_id, None)
+            self.due.pop(user_id, None)
+
+    def get(self, user_id: str):
+        """Cached credentials for `user_id` if still valid, else None."""
+        with self.cond:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            entry[1] = time.time()
+            return entry[0] if entry[0].valid else None
+
+    def _due_for(self, creds) -> float:
+        if not creds.expiry:
+            return time.time() + self.idle_ttl_s
+        # google-auth keeps `expiry` as naive UTC
+        now_utc = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        seconds_left = (creds.expiry - now_utc).total_seconds()
+        return time.time() + max(0.0, seconds_left - self.margin_s)
+
+    def _schedule(self, user_id: str, due: float):
+        self.due[user_id] = due
+        heapq.heappush(self.heap, (due, user_id))
+
+    def start(self):
+        with self.cond:
+            if self.thread and self.thread.is_alive():
+                return
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def _next_job(self):
+        """Blocks until a refresh is due; returns (user_id, creds) or None when stopping."""
+        with self.cond:
+            while True:
+                if self.stopping:
+                    return None
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                due, user_id = self.heap[0]
+                wait = due - time.time()
+                if wait > 0:
+                    self.cond.wait(timeout=wait)
+                    continue
+
+                heapq.heappop(self.heap)
+                if self.due.get(user_id) != due:
+                    continue  # superseded by a later schedule
+                entry = self.entries.get(user_id)
+                if entry is None or time.time() - entry[1] > self.idle_ttl_s:
+                    self.entries.pop(user_id, None)
+                    self.due.pop(user_id, None)
+                    continue
+                return user_id, entry[0]
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            user_id, creds = job
+            try:
+                refreshed = self.refresh_fn(user_id, creds)
+                with self.cond:
+                    self.refreshed += 1
+                    if user_id in self.entries:
+                        self.entries[user_id][0] = refreshed
+                        self._schedule(user_id, self._due_for(refreshed))
+            except Exception as e:
+                if self.is_permanent(e):
+                    with self.cond:
+                        entry = self.entries.get(user_id)
+                        if entry is not None and entry[0] is not creds:
+                            continue  # reconnected with new credentials meanwhile
+                        self.entries.pop(user_id, None)
+                        self.due.pop(user_id, None)
+                        self.revoked += 1
+                    logger.warning("token refresh rejected, dropping user", extra={"user_id": user_id, "error": str(e)})
+                    if self.on_revoked:
+                        try:
+                            self.on_revoked(user_id, e)
+                        except Exception:
+                            logger.exception("on_revoked callback failed")
+                    continue
+                logger.warning("token refresh failed", extra={"user_id": user_id, "error": str(e)})
+                with self.cond:
+                    self.failed += 1
+                    self._schedule(user_id, time.time() + self.retry_s)
+
+    def stats(self) -> dict:
+        with self.cond:
+            next_due = min(self.due.values()) if self.due else None
+            return {
+                "tracked_users": len(self.entries),
+                "refreshed": self.refreshed,
+                "failed": self.failed,
+                "revoked": self.revoked,
+                "next_refresh_in_s": round(next_due - time.time(), 1) if next_due else None,
+                "running": bool(self.thread and self.thread.is_alive()),
+            }
@@ -6,26 +6,39 @@ try:
 except ImportError:
     GEMINI_API_KEY = None
 import datetime
+import asyncio
+import threading
+from contextlib import contextmanager
+import retry_policy
+import intent_classifier
+import log_config
+
+logger = log_config.get_logger("agent")
 
 # Prioritize environment variable (for Render), fallback to local file
 api_key = os.getenv("GEMINI_API_KEY") or GEMINI_API_KEY
 
 if not api_key:
     # Print warning but don't crash yet, let the agent fail gracefully if called
-    print("WARNING: GEMINI_API_KEY not found in environment or app_secrets.py")
+    logger.warning("GEMINI_API_KEY not found in environment or app_secrets.py")
 
 if api_key:
     genai.configure(api_key=api_key)
 
 import google_calendar
 
-class GeminiAgent:
-    def __init__(self, user_id: str = "guest_user"):
-        self.user_id = user_id
-        self.user_timezone = "UTC"  # Default timezone, updated from context
-        self.calendar_service = google_calendar.GoogleCalendarService(user_id=self.user_id)
-        # System instruction to restrict chatbot to health-related topics only
-        system_instruction = """
+# Tool calls emitted in one model turn run concurrently, each bounded by this timeout
+TOOL_TIMEOUT_S = float(os.getenv("AGENT_TOOL_TIMEOUT_S", "20"))
+MAX_TOOL_ROUNDS = 5
+# Sent back for calls requested after MAX_TOOL_ROUNDS, alongside a no-tools turn
+TOOL_LIMIT_RESULT = {"status": "skipped", "message": "Tool call limit reached. Answer with the results you already have."}
+TOOL_LIMIT_REPLY = "I wasn't able to finish that request. Please try again, or ask for one thing at a time."
+
+# Route chat turns through intent_classifier before calling the model
+INTENT_ROUTING = os.getenv("INTENT_ROUTING", "1") == "1"
+
+# System instruction to restrict chatbot to health-related topics only
+SYSTEM_INSTRUCTION = """
         You are Bio-Twin, a specialized health assistant. Your primary purpose is to help with health, wellness, medical, and fitness-related questions.
         
         STRICT RULES:
@@ -35,56 +48,140 @@ class GeminiAgent:
         4. Your response to non-health factual/knowledge questions should be: "I'm Bio-Twin, your health assistant. I can only help with health, wellness, and medical questions. Please ask me something related to your health!"
         5. Always maintain a friendly, supportive, and professional tone.
         """
-        
+
+# Tool schemas declared once instead of introspecting bound methods for every agent.
+# Calls are dispatched by name to the agent that owns the chat (see GeminiAgent._run_tool).
+TOOL_DECLARATIONS = Tool(function_declarations=[
+    FunctionDeclaration(
+        name="book_appointment",
+        description="Books a medical appointment for a specific reason and date. Date should be in ISO format (YYYY-MM-DDTHH:MM:SS). If that time is already taken nothing is booked: the result has status 'conflict' and a `suggested` free time to offer the user.",
+        parameters={
+            "type": "OBJECT",
+            "properties": {"reason": {"type": "STRING"}, "date": {"type": "STRING"}},
+            "required": ["reason", "date"],
+        },
+    ),
+    FunctionDeclaration(
+        name="block_calendar_for_nap",
+        description="Blocks the user's calendar for a nap or rest period.",
+        parameters={
+            "type": "OBJECT",
+            "properties": {"duration_mins": {"type": "INTEGER"}},
+            "required": ["duration_mins"],
+        },
+    ),
+    FunctionDeclaration(
+        name="order_supplements",
+        description="Orders health supplements.",
+        parameters={
+            "type": "OBJECT",
+            "properties": {"item_name": {"type": "STRING"}},
+            "required": ["item_name"],
+        },
+    ),
+])
+
+# Shared GenerativeModel objects keyed by (model name, tool names, system instruction)
+_model_cache = {}
+_model_cache_lock = threading.Lock()
+
+
+def get_model(model_name: str, tools: Tool = TOOL_DECLARATIONS, system_instruction: str = SYSTEM_INSTRUCTION):
+    """Returns a GenerativeModel built once per configuration and shared by all agents (`tools=None` for none)."""
+    tool_names = tuple(declaration.name for declaration in tools.function_declarations) if tools else ()
+    key = (model_name, tool_names, system_instruction)
+    model = _model_cache.get(key)
+    if model is None:
+        with _model_cache_lock:
+            model = _model_cache.get(key)
+            if model is None:
+                model = genai.GenerativeModel(
+                    model_name=model_name,
+                    tools=tools,
+                    system_instruction=system_instruction
+                )
+                _model_cache[key] = model
+    return model
+
+
+def _function_calls(response) -> list:
+    parts = response.candidates[0].content.parts if response.candidates else []
+    return [part.function_call for part in parts if "function_call" in part]
+
+
+def _reply_text(response) -> str:
+    """`response.text`, or TOOL_LIMIT_REPLY if the model still answered with only tool calls."""
+    if _function_calls(response) and not any(part.text for part in response.candidates[0].content.parts):
+        return TOOL_LIMIT_REPLY
+    return response.text
+
+
+class GeminiAgent:
+    def __init__(self, user_id: str = "guest_user"):
         # Initialize Gemini model with tools and system instruction
         # Primary: gemini-3-flash, Fallback: gemini-2.5-flash, Final Backup: gemini-1.5-flash
         self.primary_model_name = 'models/gemini-3-flash-preview'
         self.fallback_model_name = 'models/gemini-2.5-flash'
         self.backup_model_name = 'models/gemini-1.5-flash'
-        self.system_instruction = system_instruction
-        self.tools_list = [self.book_appointment, self.block_calendar_for_nap, self.order_supplements]
-        
+        # Cheaper tier for simple health questions (see intent_classifier)
+        self.light_model_name = 'models/gemini-2.5-flash-lite'
+        self.system_instruction = SYSTEM_INSTRUCTION
+        self.tools = {
+            tool.__name__: tool
+            for tool in (self.book_appointment, self.block_calendar_for_nap, self.order_supplements)
+        }
+        # Tool threads still running, including ones `_run_tool` stopped waiting for
+        self.tools_in_flight = 0
+        self._tools_lock = threading.Lock()
+        self.reset(user_id)
+
+    def reset(self, user_id: str):
+        """Binds the agent to `user_id` with a fresh chat session on the primary model."""
+        self.user_id = user_id
+        self.user_timezone = "UTC"  # Default timezone, updated from context
+        # Created on first tool use; constructing it reads Firestore
+        self._calendar_service = None
+
         # Try primary model first
         try:
-            self.model = genai.GenerativeModel(
-                model_name=self.primary_model_name,
-                tools=self.tools_list,
-                system_instruction=system_instruction
-            )
+            self.model = get_model(self.primary_model_name)
             self.current_model = self.primary_model_name
         except Exception as e:
-            print(f"Primary model failed, using fallback: {e}")
-            self.model = genai.GenerativeModel(
-                model_name=self.fallback_model_name,
-                tools=self.tools_list,
-                system_instruction=system_instruction
-            )
+            logger.warning("primary model failed, using fallback", extra={"error": str(e)})
+            self.model = get_model(self.fallback_model_name)
             self.current_model = self.fallback_model_name
-            
-        self.chat = self.model.start_chat(enable_automatic_function_calling=True)
+
+        # Tool calls are dispatched by `_send` so independent calls can run in parallel
+        self.chat = self.model.start_chat()
+
+    @property
+    def calendar_service(self):
+        if self._calendar_service is None:
+            self._calendar_service = google_calendar.GoogleCalendarService(user_id=self.user_id)
+        return self._calendar_service
+
+    @calendar_service.setter
+    def calendar_service(self, service):
+        self._calendar_service = service
 
     def book_appointment(self, reason: str, date: str):
-        """Books a medical appointment for a specific reason and date. Date should be in ISO format (YYYY-MM-DDTHH:MM:SS)"""
-        print(f"\n[TOOL EXECUTION] Booking appointment for '{reason}' on {date} (timezone: {self.user_timezone})...")
+        """Books a medical appointment for a specific reason and date. Date should be in ISO format (YYYY-MM-DDTHH:MM:SS). If that time is already taken nothing is booked: the result has status 'conflict' and a `suggested` free time to offer the user."""
+        logger.info("tool book_appointment", extra={"user_id": self.user_id, "date": date, "timezone": self.user_timezone})
         
         # IMPORTANT: Re-instantiate calendar service to pick up fresh tokens from Firestore
         # This fixes the stale session bug where an old agent has an unauthorized service
-        self.calendar_service = google_calendar.GoogleCalendarService(user_id=self.user_id)
+        service = google_calendar.GoogleCalendarService(user_id=self.user_id)
+        self.calendar_service = service
         
-        print(f"[DEBUG] Agent user_id: {self.user_id}")
-        print(f"[DEBUG] Calendar service user_id: {self.calendar_service.user_id}")
-        print(f"[DEBUG] Calendar has creds: {self.calendar_service.creds is not None}")
-        if self.calendar_service.creds:
-            print(f"[DEBUG] Creds valid: {self.calendar_service.creds.valid}")
-            print(f"[DEBUG] Creds expired: {self.calendar_service.creds.expired}")
-        is_auth = self.calendar_service.is_authorized()
-        print(f"[DEBUG] is_authorized result: {is_auth}")
+        is_auth = service.is_authorized()
+        logger.debug("calendar authorization checked", extra={"user_id": service.user_id, "authorized": is_auth})
         if is_auth:
-            result = self.calendar_service.create_event(
+            result = service.create_event(
                 reason, 
                 "Medical appointment booked by Bio-Twin", 
                 date,
-                timezone=self.user_timezone
+                timezone=self.user_timezone,
+                on_conflict="suggest"
             )
             # Remove link so agent doesn't spam it in chat
             if isinstance(result, dict) and "link" in result:
@@ -92,7 +189,7 @@ class GeminiAgent:
             return result
         else:
             # Fallback to mock for demo if not signed in
-            print("[AGENT] Calendar not authorized. Returning detailed SIMULATION message.")
+            logger.info("calendar not authorized, simulating booking", extra={"user_id": self.user_id})
             return {
                 "status": "simulated", 
                 "message": "⚠️ [DEMO MODE] Google Calendar is NOT connected. I have verified the intent but CANNOT actually book this yet. Please connect your calendar in the dashboard.", 
@@ -101,11 +198,13 @@ class GeminiAgent:
 
     def block_calendar_for_nap(self, duration_mins: int):
         """Blocks the user's calendar for a nap or rest period."""
-        print(f"\n[TOOL EXECUTION] Blocking calendar for {duration_mins} mins nap (timezone: {self.user_timezone}).")
-        if self.calendar_service.is_authorized():
+        logger.info("tool block_calendar_for_nap", extra={"user_id": self.user_id, "duration_mins": duration_mins})
+        # Read once: every step below must act on the same user's calendar
+        service = self.calendar_service
+        if service.is_authorized():
             # Set timezone on calendar service before blocking
-            self.calendar_service.current_user_timezone = self.user_timezone
-            result = self.calendar_service.block_time("Rest/Nap Period", duration_mins)
+            service.current_user_timezone = self.user_timezone
+            result = service.block_time("Rest/Nap Period", duration_mins)
             # Remove link so agent doesn't spam it in chat
             if isinstance(result, dict) and "link" in result:
                 del result["link"]
@@ -115,15 +214,15 @@ class GeminiAgent:
 
     def order_supplements(self, item_name: str):
         """Orders health supplements."""
-        print(f"\n[TOOL EXECUTION] Ordering supplement: {item_name}...")
+        logger.info("tool order_supplements", extra={"user_id": self.user_id, "item": item_name})
         # Mock E-commerce API (remains mock as per plan)
         return {"status": "ordered", "item": item_name, "eta": "2 days"}
 
-    def run(self, health_context: dict):
+    async def run(self, health_context: dict):
         """
         Runs the agent loop based on provided health context/data.
         """
-        print("Agent thinking...")
+        logger.debug("agent run", extra={"user_id": self.user_id})
         
         # Construct a prompt based on the context
         prompt = f"""
@@ -141,15 +240,106 @@ class GeminiAgent:
         Do not just give advice; ACT using the tools.
         """
         
-        response = self.chat.send_message(prompt)
-        return response.text
+        response = await self._send(prompt, retry_policy.chat_policy.deadline())
+        return _reply_text(response)
+
+    async def _send(self, message, deadline: float = None):
+        """
+        Sends `message` and resolves any tool calls the model asks for.
+        All function calls from one model turn run concurrently and their results
+        go back to the model together in a single follow-up turn. After
+        MAX_TOOL_ROUNDS, further calls are declined and a final turn is sent with
+        tools disabled so the model answers in text.
+        """
+        response = await self._send_turn(message, deadline)
+
+        for round_number in range(MAX_TOOL_ROUNDS + 1):
+            function_calls = _function_calls(response)
+            if not function_calls:
+                break
 
-    def reply(self, user_message: str, context: dict = None):
+            if round_number == MAX_TOOL_ROUNDS:
+                # Out of rounds: decline the pending calls and make the model answer in text
+                logger.warning("tool round limit reached", extra={"model": self.current_model, "rounds": MAX_TOOL_ROUNDS})
+                response_parts = [
+                    genai.protos.Part(function_response=genai.protos.FunctionResponse(name=call.name, response=TOOL_LIMIT_RESULT))
+                    for call in function_calls
+                ]
+                response = await self._send_turn(
+                    genai.protos.Content(parts=response_parts), deadline,
+                    tool_config={"function_calling_config": {"mode": "NONE"}},
+                )
+                break
+
+            results = await asyncio.gather(*(self._run_tool(call) for call in function_calls))
+            response_parts = [
+                genai.protos.Part(function_response=genai.protos.FunctionResponse(name=call.name, response=result))
+                for call, result in zip(function_calls, results)
+            ]
+            response = await self._send_turn(genai.protos.Content(parts=response_parts), deadline)
+
+        return response
+
+    async def _send_turn(self, content, deadline: float = None, **kwargs):
+        """
+        One `send_message` on the current session. Sends are not idempotent, so an
+        attempt abandoned at the deadline is not retried; its thread may still append
+        the turn later, so the agent moves to a fresh session built from the history
+        as it was before the send.
+        """
+        chat = self.chat
+        history = list(chat.history)
+        try:
+            return await retry_policy.chat_policy.call(
+                chat.send_message, content, deadline=deadline, label=self.current_model,
+                idempotent=False, **kwargs
+            )
+        except retry_policy.AttemptAbandoned:
+            if self.chat is chat:
+                self.chat = chat.model.start_chat(history=history)
+            raise
+
+    async def _run_tool(self, function_call) -> dict:
+        """Runs one tool call in a worker thread under TOOL_TIMEOUT_S. Errors are reported back to the model."""
+        tool = self.tools.get(function_call.name)
+        if tool is None:
+            return {"status": "error", "message": f"Unknown tool: {function_call.name}"}
+
+        args = type(function_call).to_dict(function_call).get("args", {})
+        with self._tools_lock:
+            self.tools_in_flight += 1
+        try:
+            result = await asyncio.wait_for(asyncio.to_thread(self._call_tool, tool, args), timeout=TOOL_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            logger.warning("tool timed out", extra={"tool": function_call.name, "timeout_s": TOOL_TIMEOUT_S})
+            return {"status": "error", "message": f"{function_call.name} timed out"}
+        except Exception as e:
+            logger.exception("tool failed", extra={"tool": function_call.name})
+            return {"status": "error", "message": str(e)}
+
+        return result if isinstance(result, dict) else {"result": result}
+
+    def _call_tool(self, tool, args: dict):
+        # Runs in the worker thread; the count drops only when the tool really finishes
+        try:
+            return tool(**args)
+        finally:
+            with self._tools_lock:
+                self.tools_in_flight -= 1
+
+    async def reply(self, user_message: str, context: dict = None):
         """
         Direct chat with the user, optionally context-aware.
         Enforces health-only topic restriction.
-        Automatically falls back through multiple models on quota errors.
+        Greetings and off-topic questions are answered locally by `intent_classifier`;
+        simple health questions go to the light model, everything else to the primary chain.
+        Retries under `retry_policy.chat_policy` and falls back through multiple models on quota errors.
         """
+        # Classify only when routing is on, so the classifier's avoidance stats stay honest
+        intent = intent_classifier.classifier.classify(user_message, has_context=bool(context)) if INTENT_ROUTING else None
+        if intent and intent.local_reply:
+            logger.debug("intent answered locally", extra={"intent": intent.label})
+            return intent.local_reply
         # Style instruction with health-only enforcement
         style_instruction = """
         
@@ -165,12 +355,11 @@ IMPORTANT:
             if isinstance(context, dict):
                 if "timezone" in context:
                     self.user_timezone = context["timezone"]
-                    print(f"[TIMEZONE] Using timezone from context: {self.user_timezone}")
+                    logger.debug("timezone from context", extra={"timezone": self.user_timezone})
                 
                 # Extract current datetime for accurate scheduling
                 current_datetime = context.get("currentDateTime", "")
                 if current_datetime:
-                    print(f"[DATETIME] Current time in user's timezone: {current_datetime}")
                     # Inject current datetime into the context for the AI
                     datetime_info = f"\n\nCURRENT DATE/TIME INFO:\n- Current time: {current_datetime}\n- Timezone: {self.user_timezone}\nUse this as reference when scheduling appointments. 'Tomorrow' means the day after this date.\n"
                     final_message = f"CONTEXT START\n{context}{datetime_info}\nCONTEXT END\n\nUser Question: {user_message}{style_instruction}"
@@ -179,50 +368,107 @@ IMPORTANT:
             else:
                 final_message = f"CONTEXT START\n{context}\nCONTEXT END\n\nUser Question: {user_message}{style_instruction}"
         
+        deadline = retry_policy.chat_policy.deadline()
+        fallback_chain = [
+            (self.fallback_model_name, "primary model quota exhausted, switching to fallback"),
+            (self.backup_model_name, "fallback model quota exhausted, switching to backup"),
+        ]
+
+        if intent and intent.label == intent_classifier.SIMPLE:
+            try:
+                return await self._reply_light(final_message, deadline)
+            except Exception as e:
+                logger.warning("light model failed", extra={"error": type(e).__name__, "model": self.current_model})
+
+        while True:
+            try:
+                response = await self._send(final_message, deadline)
+                return _reply_text(response)
+            except Exception as e:
+                # Only quota/rate limit errors (429) move down the model chain
+                if retry_policy.classify_error(e) != retry_policy.QUOTA or not fallback_chain:
+                    raise e
+                next_model, message = fallback_chain.pop(0)
+                if next_model == self.current_model:
+                    continue
+                logger.warning(message, extra={"model": next_model})
+                self._switch_model(next_model)
+
+    async def _reply_light(self, message: str, deadline: float = None):
+        """
+        Answers on the light model using a chat seeded with this session's history.
+        The light tier gets no tools, so when it fails and `reply` falls back to the
+        primary chain, no tool has run yet and nothing can be executed twice.
+        """
+        main_chat, main_model = self.chat, self.current_model
+        light_chat = get_model(self.light_model_name, tools=None, system_instruction=self.system_instruction)\
+            .start_chat(history=main_chat.history)
+        self.chat, self.current_model = light_chat, self.light_model_name
         try:
-            response = self.chat.send_message(final_message)
-            return response.text
-        except Exception as e:
-            # Check if it's a quota/rate limit error (429)
-            if "429" in str(e) or "quota" in str(e).lower() or "ResourceExhausted" in str(e):
-                print(f"[FALLBACK] Primary model quota exhausted. Switching to {self.fallback_model_name}...")
-                
-                # Switch to fallback model
-                try:
-                    self.model = genai.GenerativeModel(
-                        model_name=self.fallback_model_name,
-                        tools=self.tools_list,
-                        system_instruction=self.system_instruction
-                    )
-                    self.current_model = self.fallback_model_name
-                    self.chat = self.model.start_chat(enable_automatic_function_calling=True)
-                    
-                    # Retry with fallback
-                    response = self.chat.send_message(final_message)
-                    return response.text
-                except Exception as e2:
-                    # Check if fallback also hit rate limit
-                    if "429" in str(e2) or "quota" in str(e2).lower() or "ResourceExhausted" in str(e2):
-                        print(f"[FINAL BACKUP] Fallback model also exhausted. Switching to {self.backup_model_name}...")
-                        
-                        # Switch to backup model (gemini-1.5-flash)
-                        self.model = genai.GenerativeModel(
-                            model_name=self.backup_model_name,
-                            tools=self.tools_list,
-                            system_instruction=self.system_instruction
-                        )
-                        self.current_model = self.backup_model_name
-                        self.chat = self.model.start_chat(enable_automatic_function_calling=True)
-                        
-                        # Retry with backup
-                        response = self.chat.send_message(final_message)
-                        return response.text
-                    else:
-                        # Re-raise non-quota errors from fallback
-                        raise e2
+            response = await self._send(message, deadline)
+            # Keep the conversation continuous on the primary chat
+            main_chat.history = light_chat.history
+            return _reply_text(response)
+        finally:
+            self.chat, self.current_model = main_chat, main_model
+
+    def _switch_model(self, model_name: str):
+        """Rebuilds the model and chat session on `model_name`."""
+        self.model = get_model(model_name, system_instruction=self.system_instruction)
+        self.current_model = model_name
+        self.chat = self.model.start_chat()
+
+
+class AgentPool:
+    """
+    Recycles GeminiAgent instances for stateless requests such as /agent-act.
+    Agents share cached models and are bound to a user with a fresh chat at checkout,
+    so nothing carries over between requests. An agent whose timed-out tool is still
+    running is not pooled: rebinding it could let that tool act for the next user.
+    """
+
+    def __init__(self, max_idle: int = 16):
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def acquire(self, user_id: str) -> GeminiAgent:
+        with self.lock:
+            agent = self.idle.pop() if self.idle else None
+            if agent is None:
+                self.created += 1
             else:
-                # Re-raise non-quota errors
-                raise e
+                self.reused += 1
+        if agent is None:
+            return GeminiAgent(user_id=user_id)
+        agent.reset(user_id)
+        return agent
+
+    def release(self, agent: GeminiAgent):
+        with self.lock:
+            if agent.tools_in_flight:
+                self.discarded += 1
+            elif len(self.idle) < self.max_idle:
+                self.idle.append(agent)
+
+    @contextmanager
+    def checkout(self, user_id: str):
+        agent = self.acquire(user_id)
+        try:
+            yield agent
+        finally:
+            self.release(agent)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"idle": len(self.idle), "created": self.created, "reused": self.reused,
+                    "discarded": self.discarded, "cached_models": len(_model_cache)}
+
+
+agent_pool = AgentPool()
 
 if __name__ == "__main__":
     # Test Scenario
@@ -237,6 +483,6 @@ if __name__ == "__main__":
     }
     
     print(f"Input Data: {dummy_health_data}")
-    result = agent.run(dummy_health_data)
+    result = asyncio.run(agent.run(dummy_health_data))
     print("\nAgent Response:")
     print(result)
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+import fast_json
+
+
+class TwinEventHub:
+    """
+    In-process pub/sub fan-out of twin updates to per-user subscribers.
+
+    Each subscriber is just a small bounded asyncio.Queue, so an idle connection
+    costs one queue and no polling. Events are serialized once per publish and the
+    same string is handed to every subscriber. A slow subscriber drops its oldest
+    events rather than growing without bound. `publish` is safe to call from
+    worker threads (e.g. the write-behind flusher).
+    """
+
+    def __init__(self, queue_size: int = 16):
+        self.queue_size = queue_size
+        self.subscribers = defaultdict(set)
+        self.loop = None
+        self.lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def bind(self, loop):
+        """Attach to the server's event loop (called at startup)."""
+        self.loop = loop
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+
+    def publish(self, user_id: str, event_type: str, data=None):
+        if self.loop is None or user_id not in self.subscribers:
+            return
+        payload = fast_json.dumps({"type": event_type, "data": data}).decode()
+        with self.lock:
+            self.published += 1
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._fan_out(user_id, payload)
+        else:
+            self.loop.call_soon_threadsafe(self._fan_out, user_id, payload)
+
+    def _fan_out(self, user_id: str, payload: str):
+        for queue in list(self.subscribers.get(user_id, ())):
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(payload)
+            self.delivered += 1
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.subscribers),
+            "connections": sum(len(queues) for queues in self.subscribers.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+hub = TwinEventHub()
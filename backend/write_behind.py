@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import uuid
+import datetime
+import threading
+
+import log_config
+import retry_policy
+
+logger = log_config.get_logger("write_behind")
+
+# Firestore batches accept at most 500 writes
+MAX_BATCH = 500
+# Jobs held in memory (and spool) while Firestore is unreachable
+MAX_BACKLOG = int(os.getenv("WRITE_BEHIND_MAX_BACKLOG", "10000"))
+# Failed single-job writes before a job is moved to the dead-letter file
+MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "10"))
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot spool {type(value).__name__}")
+
+
+def _decode(obj):
+    if "__datetime__" in obj:
+        return datetime.datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class WriteBehindQueue:
+    """
+    Write-behind persistence for Firestore documents.
+
+    `enqueue` appends the job to an append-only spool file (so it survives a
+    restart) and returns immediately. A background thread flushes pending jobs
+    as Firestore batched writes when `batch_size` jobs are waiting or
+    `flush_interval_s` has passed. When a batch fails its jobs are retried one
+    at a time, so one bad document can't hold back the rest; a job whose error
+    is not retryable, or that has failed `max_attempts` times, is moved to the
+    dead-letter file (`{spool_path}.dead`, one JSON line per job) and
+    acknowledged. While Firestore itself is failing the flusher backs off.
+    Every job has a fixed document id, so replaying a job after a crash
+    overwrites rather than duplicates.
+
+    Spool format: one JSON line per event, {"op": "put", "job": {...}} or
+    {"op": "ack", "ids": [...]}. On start the spool is replayed and compacted
+    to the jobs that were never acknowledged; it is truncated whenever the
+    queue fully drains.
+
+    The backlog is capped at `max_backlog` jobs. A spool write failure (e.g. a
+    full disk) is logged and the job is kept in memory only; it never reaches
+    the caller.
+    """
+
+    def __init__(self, db, spool_path: str, batch_size: int = 50, flush_interval_s: float = 1.0,
+                 max_backoff_s: float = 60.0, on_flushed=None, max_backlog: int = MAX_BACKLOG,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.db = db
+        self.spool_path = spool_path
+        self.batch_size = min(batch_size, MAX_BATCH)
+        self.flush_interval_s = flush_interval_s
+        self.max_backoff_s = max_backoff_s
+        self.max_backlog = max_backlog
+        self.max_attempts = max_attempts
+        self.dead_letter_path = f"{spool_path}.dead"
+        # Called with the list of jobs written by each successful batch
+        self.on_flushed = on_flushed
+        self.cond = threading.Condition()
+        self.pending = []  # jobs in enqueue order
+        self.attempts = {}  # job id -> failed single-job writes
+        self.spool = None
+        self.thread = None
+        self.stopping = False
+        self.written = 0
+        self.failed_batches = 0
+        self.last_flush_at = None
+        self.last_error = None
+        self.dropped = 0
+        self.spool_errors = 0
+        self.dead_lettered = 0
+
+    # --- public API ---
+
+    def enqueue(self, path: tuple, data: dict, doc_id: str = None, block: bool = False) -> str:
+        """
+        Queues `data` for the document at `path` + `doc_id` (collection, doc, collection, ...).
+        Returns the document id the data will be written under, or None if the backlog
+        is full and the job was dropped. With `block`, waits for room instead (batch
+        jobs such as imports, never request handlers).
+        """
+        job = {
+            "id": doc_id or uuid.uuid4().hex,
+            "path": list(path),
+            "data": data,
+            "enqueued_at": time.time(),
+        }
+        with self.cond:
+            while block and len(self.pending) >= self.max_backlog and not self.stopping:
+                self.cond.wait()
+            if len(self.pending) >= self.max_backlog:
+                self.dropped += 1
+                logger.error("write-behind backlog full, dropping write",
+                             extra={"backlog": len(self.pending), "path": "/".join(job["path"])})
+                return None
+            try:
+                self._spool_write({"op": "put", "job": job})
+            except (OSError, TypeError, ValueError) as e:
+                # Still written to Firestore if it stays up; only lost if we crash first
+                self.spool_errors += 1
+                logger.error("spool write failed, write kept in memory only", extra={"error": str(e)})
+            self.pending.append(job)
+            if len(self.pending) >= self.batch_size:
+                self.cond.notify()
+        return job["id"]
+
+    def start(self):
+        with self.cond:
+            if self.thread and self.thread.is_alive():
+                return
+            self._recover()
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stops the flusher after a final flush attempt; anything left stays in the spool."""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=timeout)
+            if self.thread.is_alive():
+                # Still inside a flush: closing the spool now would break it mid-write
+                logger.warning("write-behind flusher still running after stop timeout", extra={"timeout_s": timeout})
+                return
+        with self.cond:
+            if self.spool:
+                self.spool.close()
+                self.spool = None
+
+    def stats(self) -> dict:
+        with self.cond:
+            oldest = self.pending[0]["enqueued_at"] if self.pending else None
+            return {
+                "backlog": len(self.pending),
+                "lag_s": round(time.time() - oldest, 3) if oldest else 0.0,
+                "written": self.written,
+                "failed_batches": self.failed_batches,
+                "last_flush_at": self.last_flush_at,
+                "last_error": self.last_error,
+                "dropped": self.dropped,
+                "spool_errors": self.spool_errors,
+                "dead_lettered": self.dead_lettered,
+                "running": bool(self.thread and self.thread.is_alive()),
+            }
+
+    # --- spool ---
+
+    def _spool_write(self, event: dict):
+        if self.spool is None:
+            self.spool = open(self.spool_path, "a", encoding="utf-8")
+        self.spool.write(json.dumps(event, default=_encode) + "\n")
+        self.spool.flush()
+        os.fsync(self.spool.fileno())
+
+    def _recover(self):
+        """Replays the spool, keeps unacknowledged jobs and rewrites the spool with only those."""
+        jobs = {}
+        if os.path.exists(self.spool_path):
+            with open(self.spool_path, encoding="utf-8") as spool:
+                for line in spool:
+                    try:
+                        event = json.loads(line, object_hook=_decode)
+                    except ValueError:
+                        continue  # torn final line from a crash mid-write
+                    if event.get("op") == "put":
+                        jobs[event["job"]["id"]] = event["job"]
+                    elif event.get("op") == "ack":
+                        for job_id in event["ids"]:
+                            jobs.pop(job_id, None)
+
+        if self.spool:
+            self.spool.close()
+        tmp_path = f"{self.spool_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as tmp:
+            for job in jobs.values():
+                tmp.write(json.dumps({"op": "put", "job": job}, default=_encode) + "\n")
+        os.replace(tmp_path, self.spool_path)
+        self.spool = open(self.spool_path, "a", encoding="utf-8")
+
+        known = {job["id"] for job in self.pending}
+        recovered = [job for job in jobs.values() if job["id"] not in known]
+        self.pending = recovered + self.pending
+        if recovered:
+            logger.info("recovered unflushed writes", extra={"count": len(recovered), "spool": self.spool_path})
+
+    # --- flusher ---
+
+    def _run(self):
+        backoff = 1.0
+        while True:
+            with self.cond:
+                deadline = time.time() + self.flush_interval_s
+                while not self.stopping and len(self.pending) < self.batch_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(timeout=remaining)
+                batch = self.pending[:self.batch_size]
+                stopping = self.stopping
+
+            if batch:
+                if self._flush(batch):
+                    backoff = 1.0
+                    continue  # more may be waiting
+                if stopping:
+                    return
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff_s)
+            elif stopping:
+                return
+
+    def _flush(self, batch: list) -> bool:
+        """
+        Writes `batch` as one Firestore batch, falling back to one job at a time
+        when that fails. Returns False when nothing was written or dead-lettered,
+        i.e. the caller should back off.
+        """
+        if len(batch) > 1:
+            try:
+                self._commit(batch)
+            except Exception as e:
+                logger.warning("batch write failed, retrying jobs one at a time", extra={"size": len(batch), "error": str(e)})
+                with self.cond:
+                    self.failed_batches += 1
+                    self.last_error = str(e)
+            else:
+                self._finish(batch, [])
+                return True
+        return self._flush_each(batch)
+
+    def _flush_each(self, batch: list) -> bool:
+        written, dead = [], []
+        for job in batch:
+            try:
+                self._commit([job])
+            except Exception as e:
+                error_class = retry_policy.classify_error(e)
+                with self.cond:
+                    attempts = self.attempts[job["id"]] = self.attempts.get(job["id"], 0) + 1
+                    self.last_error = str(e)
+                if error_class == retry_policy.FATAL or attempts >= self.max_attempts:
+                    dead.append({"job": job, "error": str(e), "attempts": attempts, "dead_at": time.time()})
+                    continue
+                # Firestore itself is failing: back off before trying the rest
+                logger.warning("write failed, will retry", extra={"doc_id": job["id"], "attempts": attempts, "error": str(e)})
+                break
+            else:
+                written.append(job)
+        if not written and not dead:
+            return False
+        self._finish(written, dead)
+        return True
+
+    def _commit(self, jobs: list):
+        write_batch = self.db.batch()
+        for job in jobs:
+            ref = self.db
+            for i, part in enumerate(job["path"]):
+                ref = ref.collection(part) if i % 2 == 0 else ref.document(part)
+            write_batch.set(ref.document(job["id"]), job["data"])
+        write_batch.commit()
+
+    def _dead_letter(self, dead: list):
+        """Appends permanently failed jobs to the dead-letter file for manual replay."""
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as out:
+                for entry in dead:
+                    out.write(json.dumps(entry, default=_encode) + "\n")
+        except (OSError, TypeError, ValueError) as e:
+            logger.error("dead-letter write failed", extra={"error": str(e), "count": len(dead)})
+        for entry in dead:
+            logger.error("write dead-lettered", extra={
+                "doc_id": entry["job"]["id"], "path": "/".join(entry["job"]["path"]),
+                "attempts": entry["attempts"], "error": entry["error"],
+            })
+
+    def _finish(self, written: list, dead: list):
+        """Drops written and dead-lettered jobs from the backlog and acknowledges them in the spool."""
+        done_ids = {job["id"] for job in written} | {entry["job"]["id"] for entry in dead}
+        with self.cond:
+            if dead:
+                self._dead_letter(dead)
+                self.dead_lettered += len(dead)
+            self.pending = [job for job in self.pending if job["id"] not in done_ids]
+            for job_id in done_ids:
+                self.attempts.pop(job_id, None)
+            try:
+                if self.pending:
+                    self._spool_write({"op": "ack", "ids": sorted(done_ids)})
+                else:
+                    # Fully drained: compact the spool back to empty
+                    if self.spool:
+                        self.spool.close()
+                    self.spool = open(self.spool_path, "w", encoding="utf-8")
+            except OSError as e:
+                # Unacknowledged jobs are replayed on restart; same doc ids, so just rewritten
+                self.spool_errors += 1
+                self.spool = None
+                logger.error("spool ack failed", extra={"error": str(e)})
+            self.written += len(written)
+            if written:
+                self.last_flush_at = time.time()
+                if not dead:
+                    self.last_error = None
+            self.cond.notify_all()  # room for blocked enqueuers
+
+        if self.on_flushed and written:
+            try:
+                self.on_flushed(written)
+            except Exception:
+                logger.exception("on_flushed callback failed")